@@ -0,0 +1,190 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+
+# --- BACKENDS DEL MODELO ---
+# Interfaz común alrededor de las llamadas al modelo: cada backend expone
+# `modelo_nombre` y `generation_config` (parte de la clave de caché) y
+# `generar(prompt, esquema=None)`, que devuelve una RespuestaModelo; con
+# `esquema`, la respuesta es JSON conforme a ese esquema. BackendGemini usa la API
+# real; BackendFalso simula latencia, errores y límites de cuota para medir el
+# rendimiento sin gastar cuota.
+
+# Parámetros del modelo Gemini
+MODELO_NOMBRE = "gemini-1.5-pro-latest"
+GENERATION_CONFIG = {
+    "temperature": 0.6, "top_p": 1, "top_k": 1, "max_output_tokens": 8192
+}
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+class RespuestaModelo:
+    def __init__(self, text, tokens_entrada=None, tokens_salida=None):
+        self.text = text
+        self.tokens_entrada = tokens_entrada
+        self.tokens_salida = tokens_salida
+
+
+class BackendGemini:
+    # Cada backend tiene su propio cliente creado con su clave. genai.configure
+    # es global al proceso y el modelo crea su cliente en la primera llamada,
+    # así que con varios trabajos a la vez una corrida podía usar la clave de
+    # otro usuario.
+    def __init__(self, api_key, modelo_nombre=MODELO_NOMBRE, generation_config=None, safety_settings=None):
+        import google.generativeai as genai
+        from google.ai import generativelanguage as glm
+        self.modelo_nombre = modelo_nombre
+        self.generation_config = generation_config or GENERATION_CONFIG
+        self._model = genai.GenerativeModel(
+            model_name=modelo_nombre,
+            generation_config=self.generation_config,
+            safety_settings=safety_settings or SAFETY_SETTINGS
+        )
+        self._model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+    def generar(self, prompt, esquema=None):
+        if esquema is None:
+            response = self._model.generate_content(prompt)
+        else:
+            response = self._model.generate_content(prompt, generation_config=dict(
+                self.generation_config, response_mime_type="application/json", response_schema=esquema
+            ))
+        uso = getattr(response, "usage_metadata", None)
+        return RespuestaModelo(
+            response.text,
+            getattr(uso, "prompt_token_count", None),
+            getattr(uso, "candidates_token_count", None),
+        )
+
+
+# --- BACKEND FALSO PARA PRUEBAS DE RENDIMIENTO ---
+
+RESPUESTA_ANALISIS_FALSA = """Qué Evalúa:
+Este ítem evalúa la capacidad del estudiante para inferir la intención comunicativa de un texto a partir de sus marcas discursivas.
+
+Ruta Cognitiva Correcta:
+Para resolver correctamente este ítem, el estudiante primero debe identificar la idea central del fragmento. Luego, necesita relacionar los conectores con la postura del autor. Este proceso le permite inferir el propósito del texto, lo que finalmente lo lleva a concluir que la opción clave es la correcta porque es la única coherente con la evidencia textual.
+
+Análisis de Opciones No Válidas:
+- **Opción A:** El estudiante podría escoger esta opción si comete un error de lectura literal, lo que lo lleva a pensar que un detalle es la idea global. Sin embargo, esto es incorrecto porque el detalle no resume el texto.
+- **Opción B:** La elección de esta alternativa sugiere una falla en la inferencia. El estudiante posiblemente cree que el tema es la intención, pero la opción es inválida debido a que confunde ambos niveles.
+- **Opción C:** Esta opción funciona como un distractor para quien sobregeneraliza, interpretando erróneamente que el texto opina sobre todos los casos. Es incorrecta puesto que el texto se limita a un caso concreto."""
+
+RESPUESTA_RECOMENDACIONES_FALSA = """RECOMENDACIÓN PARA FORTALECER EL APRENDIZAJE EVALUADO EN EL ÍTEM
+Para fortalecer la habilidad de inferir, se sugiere descomponer la lectura en pistas verificables.
+Una actividad que se puede hacer es: un juego de detectives en el que cada grupo recibe tarjetas con fragmentos y debe ordenarlas según la intención que revelan.
+Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
+- ¿Qué palabras del fragmento muestran la postura del autor?
+- ¿Cómo se relaciona esta pista con la anterior?
+- ¿Qué intención explica todas las pistas a la vez?
+
+RECOMENDACIÓN PARA AVANZAR EN EL APRENDIZAJE EVALUADO EN EL ÍTEM
+Para avanzar desde inferir la intención hacia la habilidad de evaluar argumentos, se sugiere contrastar dos textos con propósitos opuestos.
+Una actividad que se puede hacer es: un tribunal de lectores en el que cada equipo defiende la eficacia comunicativa de uno de los textos.
+Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
+- ¿Qué estrategia resulta más convincente y por qué?
+- ¿Cómo cambiaría el texto si se dirigiera a otro público?
+- ¿Qué pasos de tu razonamiento te permitieron llegar a esa valoración?"""
+
+
+# Objeto por ítem de las respuestas por lotes, con los campos del esquema JSON
+_secciones_analisis = RESPUESTA_ANALISIS_FALSA.split("\n\n")
+_secciones_recomendaciones = RESPUESTA_RECOMENDACIONES_FALSA.split("\n\n")
+OBJETO_LOTE_FALSO = {
+    "que_evalua": _secciones_analisis[0].split("\n", 1)[1],
+    "ruta_correcta": _secciones_analisis[1].split("\n", 1)[1],
+    "distractores": _secciones_analisis[2].split("\n", 1)[1],
+    "fortalecer": _secciones_recomendaciones[0].split("\n", 1)[1],
+    "avanzar": _secciones_recomendaciones[1].split("\n", 1)[1],
+}
+
+PATRON_ID_LOTE = re.compile(r"^ID del ítem: (.+)$", re.MULTILINE)
+
+
+class ErrorBackendFalso(Exception):
+    def __init__(self, code, mensaje):
+        super().__init__(f"{code} {mensaje}")
+        self.code = code
+
+
+class BackendFalso:
+    # `distribucion`: "constante", "uniforme" (entre 0 y 2·media), "normal" o
+    # "lognormal", con `latencia_media` y `latencia_desv` en segundos.
+    # `tasa_error` produce errores 500 y `tasa_429` errores 429 al azar; con
+    # `limite_rpm`, además se responde 429 cuando se supera ese ritmo. En las
+    # respuestas por lotes, `tasa_omision` es la proporción de ítems omitidos.
+    def __init__(self, latencia_media=1.0, latencia_desv=0.3, distribucion="lognormal",
+                 tasa_error=0.0, tasa_429=0.0, limite_rpm=None, respuestas=None, semilla=None,
+                 tasa_omision=0.0):
+        self.modelo_nombre = "backend-falso"
+        self.generation_config = {}
+        self.latencia_media = latencia_media
+        self.latencia_desv = latencia_desv
+        self.distribucion = distribucion
+        self.tasa_error = tasa_error
+        self.tasa_429 = tasa_429
+        self.limite_rpm = limite_rpm
+        self.respuestas = respuestas or {}
+        self.tasa_omision = tasa_omision
+        self.llamadas = 0
+        self._azar = random.Random(semilla)
+        self._recientes = []
+        self._lock = threading.Lock()
+
+    def _latencia(self):
+        media, desv = self.latencia_media, self.latencia_desv
+        if self.distribucion == "constante" or media <= 0:
+            return max(0.0, media)
+        if self.distribucion == "uniforme":
+            return self._azar.uniform(0, 2 * media)
+        if self.distribucion == "normal":
+            return max(0.0, self._azar.gauss(media, desv))
+        # Lognormal con la media y desviación pedidas
+        varianza = (desv / media) ** 2
+        sigma2 = math.log1p(varianza)
+        mu = math.log(media) - sigma2 / 2
+        return self._azar.lognormvariate(mu, sigma2 ** 0.5)
+
+    # Respuesta enlatada según el tipo de prompt
+    def _respuesta(self, prompt):
+        for marca, texto in self.respuestas.items():
+            if marca in prompt:
+                return texto
+        if "RECOMENDACIÓN PARA FORTALECER" in prompt:
+            return RESPUESTA_RECOMENDACIONES_FALSA
+        return RESPUESTA_ANALISIS_FALSA
+
+    # Arreglo JSON con un objeto por cada ID del prompt, salvo los omitidos
+    def _respuesta_lote(self, prompt):
+        with self._lock:
+            ids = [id_item for id_item in PATRON_ID_LOTE.findall(prompt) if self._azar.random() >= self.tasa_omision]
+        return json.dumps([dict(OBJETO_LOTE_FALSO, id=id_item) for id_item in ids], ensure_ascii=False)
+
+    def generar(self, prompt, esquema=None):
+        with self._lock:
+            self.llamadas += 1
+            latencia = self._latencia()
+            sorteo = self._azar.random()
+            excede_rpm = False
+            if self.limite_rpm:
+                ahora = time.monotonic()
+                self._recientes = [t for t in self._recientes if ahora - t < 60]
+                excede_rpm = len(self._recientes) >= self.limite_rpm
+                if not excede_rpm:
+                    self._recientes.append(ahora)
+        if excede_rpm or sorteo < self.tasa_429:
+            time.sleep(min(latencia, 0.05))
+            raise ErrorBackendFalso(429, "Resource has been exhausted (e.g. check quota).")
+        time.sleep(latencia)
+        if sorteo < self.tasa_429 + self.tasa_error:
+            raise ErrorBackendFalso(500, "Internal error encountered.")
+        texto = self._respuesta(prompt) if esquema is None else self._respuesta_lote(prompt)
+        return RespuestaModelo(texto, max(1, len(prompt) // 4), max(1, len(texto) // 4))
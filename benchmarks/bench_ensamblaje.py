@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ensamblaje import renderizar_fichas
+
+# --- BENCHMARK DEL ENSAMBLAJE DE FICHAS ---
+# Mide documentos por segundo según el número de procesos, sobre una
+# plantilla y filas sintéticas. Se compara con la ruta original, que creaba
+# un DocxTemplate nuevo y compilaba la plantilla en cada fila.
+#
+#   python benchmarks/bench_ensamblaje.py --filas 500 --procesos 1 2 4 8
+
+CAMPOS = ["ItemId", "Enunciado", "Que_Evalua", "Justificacion_Correcta", "Analisis_Distractores",
+          "Recomendacion_Fortalecer", "Recomendacion_Avanzar"]
+
+# Plantilla de Word sintética con un párrafo por campo
+def crear_plantilla():
+    from docx import Document
+    documento = Document()
+    documento.add_heading("Ficha Técnica {{ ItemId }}", level=1)
+    for campo in CAMPOS[1:]:
+        documento.add_heading(campo, level=2)
+        documento.add_paragraph("{{ " + campo + " }}")
+    salida = BytesIO()
+    documento.save(salida)
+    return salida.getvalue()
+
+def crear_filas(total):
+    texto = "Este ítem evalúa la capacidad del estudiante para relacionar información. " * 8
+    return [
+        (f"ITEM_{i:05d}.docx", {campo: (f"ITEM_{i:05d}" if campo == "ItemId" else texto) for campo in CAMPOS})
+        for i in range(total)
+    ]
+
+# Ruta original: un DocxTemplate nuevo por fila, sin reutilizar la compilación
+def renderizar_original(plantilla_bytes, filas):
+    from docxtpl import DocxTemplate
+    for nombre, contexto in filas:
+        doc = DocxTemplate(BytesIO(plantilla_bytes))
+        doc.render(contexto)
+        salida = BytesIO()
+        doc.save(salida)
+        yield nombre, salida.getvalue()
+
+def medir(etiqueta, generador, total):
+    inicio = time.perf_counter()
+    cantidad = sum(1 for _ in generador)
+    duracion = time.perf_counter() - inicio
+    assert cantidad == total
+    print(f"{etiqueta:<28} {duracion:8.2f} s {total / duracion:10.1f} docs/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del ensamblaje de fichas")
+    parser.add_argument("--filas", type=int, default=500)
+    parser.add_argument("--procesos", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--tamano-lote", type=int, default=None)
+    args = parser.parse_args()
+
+    plantilla_bytes = crear_plantilla()
+    filas = crear_filas(args.filas)
+    print(f"{args.filas} fichas, {os.cpu_count()} CPU disponibles")
+    medir("original (serie)", renderizar_original(plantilla_bytes, filas), args.filas)
+    for procesos in sorted(set(args.procesos)):
+        medir(f"compilada, {procesos} proceso(s)",
+              renderizar_fichas(plantilla_bytes, filas, max_procesos=procesos, tamano_lote=args.tamano_lote),
+              args.filas)
+
+if __name__ == "__main__":
+    main()
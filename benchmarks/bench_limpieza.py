@@ -0,0 +1,96 @@
+import argparse
+import html
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from limpieza import limpiar_columnas
+
+# --- BENCHMARK DE LA LIMPIEZA DE HTML ---
+# Compara, sobre un DataFrame sintético de 100.000 celdas de texto:
+# - la ruta original (apply celda por celda, recompilando el patrón en cada
+#   llamada; solo quita etiquetas, no decodifica entidades ni espacios),
+# - una ruta celda por celda que hace la misma limpieza completa que la nueva,
+# - la limpieza vectorizada de limpieza.py.
+#
+#   python benchmarks/bench_limpieza.py --filas 10000 --columnas 10
+
+FRAGMENTOS = [
+    "<p>Lee el siguiente texto&nbsp;y responde.</p>",
+    "<strong>¿Cu&aacute;l</strong> es la idea principal?",
+    "El autor&nbsp;&nbsp;sugiere que <em>la ciudad</em> cambia.",
+    "Texto sin etiquetas con  espacios   repetidos.",
+    "<br/>Opción&nbsp;con salto<br>\r\nde línea",
+]
+
+# Ruta original de main.py
+def limpiar_html_original(texto_html):
+    if not isinstance(texto_html, str):
+        return texto_html
+    cleanr = re.compile('<.*?>')
+    texto_limpio = re.sub(cleanr, '', texto_html)
+    return texto_limpio
+
+# Limpieza completa celda por celda, con patrones precompilados
+ETIQUETA = re.compile(r"<[^>]*>")
+ESPACIOS = re.compile(r"[^\S\n]+")
+BORDES_LINEA = re.compile(r" ?\n ?")
+LINEAS_VACIAS = re.compile(r"\n{3,}")
+
+def limpiar_celda_completa(texto):
+    if not isinstance(texto, str):
+        return texto
+    texto = html.unescape(ETIQUETA.sub("", texto))
+    texto = BORDES_LINEA.sub("\n", ESPACIOS.sub(" ", texto))
+    return LINEAS_VACIAS.sub("\n\n", texto).strip()
+
+def crear_datos(filas, columnas, semilla=0):
+    azar = random.Random(semilla)
+    return pd.DataFrame({
+        f"Columna{c}": [" ".join(azar.choices(FRAGMENTOS, k=3)) for _ in range(filas)]
+        for c in range(columnas)
+    })
+
+def medir(etiqueta, funcion, df, celdas):
+    copia = df.copy()
+    inicio = time.perf_counter()
+    funcion(copia)
+    duracion = time.perf_counter() - inicio
+    print(f"{etiqueta:<28} {duracion:8.3f} s {celdas / duracion:12.0f} celdas/s")
+    return copia
+
+def columnas_texto(df):
+    return [col for col in df.columns if df[col].dtype == 'object' or str(df[col].dtype) in ("str", "string")]
+
+def original(df):
+    for col in columnas_texto(df):
+        df[col] = df[col].apply(limpiar_html_original)
+
+def por_celda_completa(df):
+    for col in columnas_texto(df):
+        df[col] = df[col].apply(limpiar_celda_completa)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la limpieza de HTML")
+    parser.add_argument("--filas", type=int, default=10_000)
+    parser.add_argument("--columnas", type=int, default=10)
+    args = parser.parse_args()
+
+    df = crear_datos(args.filas, args.columnas)
+    celdas = args.filas * args.columnas
+    print(f"{celdas} celdas ({args.filas} filas x {args.columnas} columnas)")
+    medir("original (solo etiquetas)", original, df, celdas)
+    esperado = medir("por celda (completa)", por_celda_completa, df, celdas)
+    resultado = medir("vectorizada (completa)", limpiar_columnas, df, celdas)
+    print(f"resultados idénticos a la ruta por celda: {esperado.equals(resultado)}")
+    restantes = resultado.stack().str.contains(r"<|&\w+;", regex=True).sum()
+    print(f"celdas con etiquetas o entidades tras la limpieza vectorizada: {restantes}")
+
+if __name__ == "__main__":
+    main()
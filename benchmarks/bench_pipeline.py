@@ -0,0 +1,179 @@
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Los datos persistentes del benchmark van a un directorio temporal propio
+os.environ.setdefault("ENSAMBLADOR_DATOS", tempfile.mkdtemp(prefix="bench_ensamblador_"))
+
+import pandas as pd
+
+import pipeline
+from backends import BackendFalso
+from bench_ensamblaje import crear_plantilla
+from corridas import AlmacenCorridas
+from motor import LimitadorTasa
+
+# --- BENCHMARK DEL PIPELINE COMPLETO CON EL BACKEND FALSO ---
+# Ejecuta carga → limpieza → enriquecimiento → exportación → ensamblaje sobre
+# libros sintéticos de 100, 1.000 y 10.000 filas, sin gastar cuota de la API.
+# Por etapa informa ítems/s, latencia p50/p95 (por llamada al backend en el
+# enriquecimiento, por ficha en el ensamblaje) y RSS máximo del proceso.
+#
+#   python benchmarks/bench_pipeline.py --tamanos 100 1000 --latencia 0.2 --concurrencia 32
+
+FRAGMENTO = "<p>Lee el siguiente texto&nbsp;y responde la pregunta sobre la intenci&oacute;n del autor.</p> "
+
+# Cada fila tiene un enunciado propio: con entradas repetidas la deduplicación
+# del plan resolvería casi todo el libro con unas pocas solicitudes y los
+# ítems/s no medirían el enriquecimiento
+def crear_libro(ruta, filas):
+    pd.DataFrame({
+        "ItemId": [f"ITEM_{i:05d}" for i in range(filas)],
+        "ItemContexto": [FRAGMENTO * 20 for _ in range(filas)],
+        "ItemEnunciado": [FRAGMENTO for _ in range(filas)],
+        "Enunciado": [f"{FRAGMENTO}Pregunta {i}." for i in range(filas)],
+        "OpcionA": ["Opción A"] * filas, "OpcionB": ["Opción B"] * filas,
+        "OpcionC": ["Opción C"] * filas, "OpcionD": ["Opción D"] * filas,
+        "AlternativaClave": ["B"] * filas,
+        "CompetenciaNombre": ["Lectura crítica"] * filas,
+        "AfirmacionNombre": ["Comprende el sentido global"] * filas,
+        "EvidenciaNombre": [f"Evidencia {i % 7}" for i in range(filas)],
+        "ItemGradoId": [5 + i % 6 for i in range(filas)],
+    }).to_excel(ruta, index=False)
+
+# Pico de RSS desde el último reinicio (Linux permite reiniciarlo con clear_refs)
+def reiniciar_pico_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as archivo:
+            archivo.write("5")
+        return True
+    except OSError:
+        return False
+
+def pico_rss_mb():
+    try:
+        with open("/proc/self/status") as archivo:
+            for linea in archivo:
+                if linea.startswith("VmHWM:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+class Medicion:
+    def __init__(self, etapa, items):
+        self.etapa = etapa
+        self.items = items
+        self.latencias = []
+
+    def __enter__(self):
+        reiniciar_pico_rss()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.duracion = time.perf_counter() - self._inicio
+        self.rss_mb = pico_rss_mb()
+        return False
+
+    def linea(self):
+        latencias = "p50 {:9.1f} ms  p95 {:9.1f} ms".format(
+            percentil(self.latencias, 50) * 1000, percentil(self.latencias, 95) * 1000
+        ) if self.latencias else f"p50 {'n/a':>9}     p95 {'n/a':>9}   "
+        return (f"  {self.etapa:<16} {self.duracion:9.2f} s {self.items / self.duracion:10.1f} ítems/s "
+                f"{latencias}  RSS máx {self.rss_mb:8.1f} MB")
+
+
+# Envoltorio del backend que mide la latencia de cada llamada
+class BackendMedido:
+    def __init__(self, backend):
+        self.backend = backend
+        self.modelo_nombre = backend.modelo_nombre
+        self.generation_config = backend.generation_config
+        self.latencias = []
+
+    def generar(self, prompt, esquema=None):
+        inicio = time.perf_counter()
+        try:
+            return self.backend.generar(prompt, esquema=esquema)
+        finally:
+            self.latencias.append(time.perf_counter() - inicio)
+
+def ejecutar(filas, args, plantilla_bytes, directorio):
+    ruta_excel = os.path.join(directorio, f"libro_{filas}.xlsx")
+    crear_libro(ruta_excel, filas)
+    mediciones = []
+
+    with Medicion("carga", filas) as medicion:
+        df = pipeline.cargar_excel(ruta_excel, pipeline.columnas_necesarias(plantilla_bytes, "ItemId"))
+    mediciones.append(medicion)
+
+    with Medicion("limpieza", filas) as medicion:
+        pipeline.limpiar_datos(df, plantilla_bytes)
+    mediciones.append(medicion)
+
+    almacen = AlmacenCorridas(os.path.join(directorio, f"corridas_{filas}.sqlite3"))
+    run_id = almacen.crear_corrida(df, os.path.basename(ruta_excel))
+    backend = BackendMedido(BackendFalso(
+        latencia_media=args.latencia, latencia_desv=args.latencia / 3, distribucion=args.distribucion,
+        tasa_error=args.tasa_error, tasa_429=args.tasa_429, tasa_omision=args.tasa_omision, semilla=filas
+    ))
+    with Medicion("enriquecimiento", filas) as medicion:
+        df = pipeline.enriquecer_corrida(
+            backend, almacen, run_id, limitador=LimitadorTasa(rpm=args.rpm, tpm=10 ** 12),
+            cache=None, max_concurrencia=args.concurrencia, tamano_lote=args.lote
+        )
+    medicion.latencias = backend.latencias
+    mediciones.append(medicion)
+
+    with Medicion("exportación", filas) as medicion:
+        pipeline.exportar_excel(df, os.path.join(directorio, f"enriquecido_{filas}.xlsx"))
+    mediciones.append(medicion)
+
+    if not args.sin_ensamblaje:
+        marcas = []
+        with Medicion("ensamblaje", filas) as medicion:
+            pipeline.ensamblar_zip(
+                df, plantilla_bytes, "ItemId", os.path.join(directorio, f"fichas_{filas}.zip"),
+                max_procesos=args.procesos, al_progresar=lambda n, total: marcas.append(time.perf_counter())
+            )
+        medicion.latencias = [b - a for a, b in zip(marcas, marcas[1:])]
+        mediciones.append(medicion)
+
+    print(f"{filas} filas (llamadas al backend: {backend.backend.llamadas}, "
+          f"filas con ERROR: {pipeline.contar_fallidas(almacen.resultados(run_id))})")
+    for medicion in mediciones:
+        print(medicion.linea())
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline completo con el backend falso")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--latencia", type=float, default=0.5, help="Latencia media del backend falso (s)")
+    parser.add_argument("--distribucion", default="lognormal", choices=["constante", "uniforme", "normal", "lognormal"])
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--tasa-429", type=float, default=0.0)
+    parser.add_argument("--tasa-omision", type=float, default=0.0, help="Ítems omitidos en las respuestas por lotes")
+    parser.add_argument("--lote", type=int, default=1, help="Ítems por solicitud (1 = dos solicitudes por ítem)")
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--rpm", type=int, default=10 ** 6)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sin-ensamblaje", action="store_true", help="Omite la etapa de ensamblaje de fichas")
+    args = parser.parse_args()
+
+    plantilla_bytes = crear_plantilla()
+    with tempfile.TemporaryDirectory() as directorio:
+        for filas in args.tamanos:
+            ejecutar(filas, args, plantilla_bytes, directorio)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+# --- CACHÉ PERSISTENTE DE RESPUESTAS DEL MODELO ---
+# Las respuestas se guardan en SQLite con una clave direccionada por contenido:
+# el hash del prompt junto con el nombre del modelo y su generation_config.
+# Un acierto evita por completo la llamada a la API.
+
+# Calcula la clave de caché para un prompt con un modelo y configuración dados
+def clave_cache(prompt, modelo_nombre, generation_config):
+    contenido = json.dumps(
+        {"modelo": modelo_nombre, "config": generation_config, "prompt": prompt},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class CacheRespuestas:
+    def __init__(self, ruta=None, max_mb=None, max_dias=None):
+        self.ruta = ruta or config.RUTA_CACHE
+        self.max_bytes = (config.CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+        self.max_edad_s = (config.CACHE_MAX_DIAS if max_dias is None else max_dias) * 86400
+        self.aciertos = 0
+        self.fallos = 0
+        self._escrituras = 0
+        self._lock = threading.Lock()
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS respuestas ("
+                " clave TEXT PRIMARY KEY, texto TEXT NOT NULL, tamano INTEGER NOT NULL,"
+                " creado REAL NOT NULL, ultimo_acceso REAL NOT NULL)"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_acceso ON respuestas (ultimo_acceso)")
+            self._conexion.commit()
+        self.expulsar()
+
+    # Devuelve el texto guardado o None; las entradas vencidas cuentan como fallo
+    def obtener(self, clave):
+        ahora = time.time()
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT texto, creado FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None or ahora - fila[1] > self.max_edad_s:
+                self.fallos += 1
+                return None
+            self._conexion.execute("UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+            self._conexion.commit()
+            self.aciertos += 1
+            return fila[0]
+
+    def guardar(self, clave, texto):
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, texto, tamano, creado, ultimo_acceso)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (clave, texto, len(texto.encode("utf-8")), ahora, ahora)
+            )
+            self._conexion.commit()
+            self._escrituras += 1
+            expulsar = self._escrituras % 100 == 0
+        if expulsar:
+            self.expulsar()
+
+    # Elimina entradas vencidas y, si se supera el tamaño máximo, las menos usadas
+    def expulsar(self):
+        with self._lock:
+            self._conexion.execute("DELETE FROM respuestas WHERE creado < ?", (time.time() - self.max_edad_s,))
+            total = self._conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+            if total > self.max_bytes:
+                exceso = total - self.max_bytes
+                liberado = 0
+                claves = []
+                for clave, tamano in self._conexion.execute(
+                    "SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso"
+                ):
+                    claves.append((clave,))
+                    liberado += tamano
+                    if liberado >= exceso:
+                        break
+                self._conexion.executemany("DELETE FROM respuestas WHERE clave = ?", claves)
+            self._conexion.commit()
+
+    # Invalida todo el contenido de la caché
+    def vaciar(self):
+        with self._lock:
+            self._conexion.execute("DELETE FROM respuestas")
+            self._conexion.commit()
+            self._conexion.execute("VACUUM")
+
+    def estadisticas(self):
+        with self._lock:
+            entradas, total = self._conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas"
+            ).fetchone()
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": entradas, "bytes": total}
@@ -0,0 +1,148 @@
+import argparse
+import os
+import sys
+import time
+
+import config
+import pipeline
+from backends import BackendFalso
+from cache import CacheRespuestas
+from corridas import AlmacenCorridas, huella_clave
+from metricas import Trazador, perfiladores_disponibles
+from motor import LimitadorTasa
+
+# --- LÍNEA DE COMANDOS ---
+# Ejecuta el pipeline completo sin Streamlit, por ejemplo como trabajo nocturno:
+#
+#   GOOGLE_API_KEY=... python cli.py datos.xlsx --plantilla plantilla.docx \
+#       --salida-excel enriquecido.xlsx --salida-zip fichas.zip
+#
+# El avance se escribe en stderr línea a línea a medida que termina cada etapa.
+
+def imprimir(mensaje):
+    print(mensaje, file=sys.stderr, flush=True)
+
+# Muestra cada etapa terminada de cada fila
+def al_progresar(evento):
+    if evento["etapa"] == "inicio":
+        imprimir(f"Filas por procesar: {evento['total']} (reutilizadas: {evento['reutilizadas']})")
+        plan = evento["plan"]
+        imprimir(f"Plan: {plan['unicas']} filas únicas ({plan['duplicadas']} duplicadas), "
+                 f"{plan['solicitudes']} solicitudes en lugar de {plan['solicitudes_sin_plan']}, "
+                 f"{plan['textos_compartidos']} textos compartidos, {plan['textos_enviados']} envíos de texto")
+        return
+    estado = f"ERROR: {evento['error']}" if evento["error"] else "ok"
+    imprimir(f"[{evento['etapa']}] {evento['completadas']}/{evento['total']} fila {evento['posicion'] + 1}: {estado}")
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Ensamblador de Fichas Técnicas con IA (sin interfaz)")
+    parser.add_argument("excel", nargs="?", help="Excel con los datos base (no hace falta al reanudar una corrida)")
+    parser.add_argument("--plantilla", help="Plantilla de Word para ensamblar las fichas")
+    parser.add_argument("--salida-excel", help="Ruta del Excel enriquecido a generar")
+    parser.add_argument("--salida-zip", help="Ruta del .zip de fichas a generar (requiere --plantilla)")
+    parser.add_argument("--columna-nombre", default="ItemId", help="Columna para nombrar las fichas (por defecto: ItemId)")
+    parser.add_argument("--solo-columnas-necesarias", action="store_true",
+                        help="Con --plantilla, lee solo las columnas de los prompts, de la plantilla y de --columna-nombre; "
+                             "--salida-excel no incluirá las demás columnas")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"), help="Clave API de Google AI (por defecto: $GOOGLE_API_KEY)")
+    parser.add_argument("--reanudar", metavar="RUN_ID", help="Reanuda una corrida guardada en lugar de crear una nueva")
+    parser.add_argument("--reprocesar-fallidas", action="store_true", help="Con --reanudar, vuelve a enviar solo las filas con ERROR")
+    parser.add_argument("--backend", choices=["gemini", "falso"], default="gemini",
+                        help="'falso' simula el modelo localmente, sin gastar cuota (para pruebas de rendimiento)")
+    parser.add_argument("--latencia-falsa", type=float, default=1.0, help="Latencia media del backend falso en segundos")
+    parser.add_argument("--tasa-error-falsa", type=float, default=0.0, help="Proporción de errores 500 del backend falso")
+    parser.add_argument("--tasa-429-falsa", type=float, default=0.0, help="Proporción de errores 429 del backend falso")
+    parser.add_argument("--tasa-omision-falsa", type=float, default=0.0,
+                        help="Proporción de ítems que el backend falso omite en las respuestas por lotes")
+    parser.add_argument("--sin-cache", action="store_true", help="No lee respuestas de la caché (las nuevas sí se guardan)")
+    parser.add_argument("--sin-deduplicar", action="store_true", help="Envía también las filas con entradas idénticas")
+    parser.add_argument("--concurrencia", type=int, default=config.MAX_CONCURRENCIA)
+    parser.add_argument("--rpm", type=int, default=config.LIMITE_RPM)
+    parser.add_argument("--tpm", type=int, default=config.LIMITE_TPM)
+    parser.add_argument("--lote", type=int, default=config.TAMANO_LOTE_PROMPTS,
+                        help="Ítems por solicitud; con más de 1 se piden análisis y recomendaciones juntos en JSON")
+    parser.add_argument("--procesos", type=int, default=config.MAX_PROCESOS_ENSAMBLAJE, help="Procesos para el ensamblaje")
+    parser.add_argument("--compresion", type=int, default=config.NIVEL_COMPRESION_ZIP, help="Nivel de compresión del .zip (0-9)")
+    parser.add_argument("--metricas-json", help="Ruta donde guardar las métricas de la corrida en JSON")
+    parser.add_argument("--metricas-csv", help="Ruta donde guardar los eventos de la corrida en CSV")
+    parser.add_argument("--perfilar", choices=perfiladores_disponibles(),
+                        help="Perfila la etapa de ensamblaje (con --procesos 1 cubre también el renderizado)")
+    return parser
+
+def main(argv=None):
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+    if not args.excel and not args.reanudar:
+        parser.error("indica el Excel de datos base o --reanudar RUN_ID")
+    if args.salida_zip and not args.plantilla:
+        parser.error("--salida-zip requiere --plantilla")
+    if args.backend == "gemini" and not args.api_key:
+        parser.error("falta la clave API (--api-key o $GOOGLE_API_KEY)")
+
+    plantilla_bytes = None
+    if args.plantilla:
+        with open(args.plantilla, "rb") as archivo:
+            plantilla_bytes = archivo.read()
+
+    almacen = AlmacenCorridas()
+    trazador = Trazador()
+    if args.reanudar:
+        run_id = args.reanudar
+    else:
+        inicio = time.perf_counter()
+        columnas = (pipeline.columnas_necesarias(plantilla_bytes, args.columna_nombre)
+                    if args.solo_columnas_necesarias else None)
+        df = pipeline.cargar_excel(args.excel, columnas, trazador=trazador)
+        pipeline.limpiar_datos(df, plantilla_bytes, trazador=trazador)
+        run_id = almacen.crear_corrida(df, os.path.basename(args.excel),
+                                       clave=huella_clave(args.api_key) if args.api_key else None)
+        imprimir(f"Datos cargados y limpios: {len(df)} filas en {time.perf_counter() - inicio:.1f} s")
+    trazador.run_id = run_id
+    imprimir(f"Corrida: {run_id} (reanudable con --reanudar {run_id})")
+
+    if args.backend == "falso":
+        backend = BackendFalso(latencia_media=args.latencia_falsa, tasa_error=args.tasa_error_falsa,
+                               tasa_429=args.tasa_429_falsa, tasa_omision=args.tasa_omision_falsa)
+    else:
+        backend = pipeline.setup_model(args.api_key)
+    inicio = time.perf_counter()
+    df = pipeline.enriquecer_corrida(
+        backend, almacen, run_id, reprocesar_fallidas=args.reprocesar_fallidas,
+        limitador=LimitadorTasa(rpm=args.rpm, tpm=args.tpm), cache=CacheRespuestas(),
+        leer_cache=not args.sin_cache, max_concurrencia=args.concurrencia, al_progresar=al_progresar,
+        trazador=trazador, tamano_lote=args.lote, deduplicar=not args.sin_deduplicar
+    )
+    fallidas = pipeline.contar_fallidas(almacen.resultados(run_id))
+    imprimir(f"Enriquecimiento terminado en {time.perf_counter() - inicio:.1f} s; filas con ERROR: {fallidas}")
+
+    if args.salida_excel:
+        pipeline.exportar_excel(df, args.salida_excel, trazador=trazador)
+        imprimir(f"Excel enriquecido: {args.salida_excel}")
+
+    if args.salida_zip:
+        inicio = time.perf_counter()
+        pipeline.ensamblar_zip(
+            df, plantilla_bytes, args.columna_nombre, args.salida_zip,
+            max_procesos=args.procesos, nivel_compresion=args.compresion,
+            al_progresar=lambda n, total: imprimir(f"[ensamblaje] {n}/{total}") if n == total or n % 100 == 0 else None,
+            trazador=trazador, perfilador=args.perfilar
+        )
+        imprimir(f"Fichas ensambladas en {time.perf_counter() - inicio:.1f} s: {args.salida_zip}")
+        if trazador.perfil:
+            imprimir(trazador.perfil)
+
+    resumen = trazador.resumen()
+    imprimir(f"Solicitudes: {resumen['solicitudes']} (caché: {resumen['aciertos_cache']}) · "
+             f"reintentos: {resumen['reintentos']} · tokens: {resumen['tokens_entrada']}/{resumen['tokens_salida']} · "
+             f"fallos de formato: {resumen['fallos_parseo']}")
+    if args.metricas_json:
+        with open(args.metricas_json, "w", encoding="utf-8") as archivo:
+            archivo.write(trazador.exportar_json())
+    if args.metricas_csv:
+        with open(args.metricas_csv, "w", encoding="utf-8", newline="") as archivo:
+            archivo.write(trazador.exportar_csv())
+
+    return 1 if fallidas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
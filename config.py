@@ -0,0 +1,73 @@
+import os
+
+# --- CONFIGURACIÓN GENERAL DEL ENSAMBLADOR ---
+# Los valores por defecto pueden sobrescribirse con variables de entorno
+# para ajustarlos al plan contratado de la API sin tocar el código.
+
+def _entero_entorno(nombre, por_defecto):
+    valor = os.environ.get(nombre)
+    if valor is None or valor.strip() == "":
+        return por_defecto
+    try:
+        return int(valor)
+    except ValueError:
+        return por_defecto
+
+def _decimal_entorno(nombre, por_defecto):
+    valor = os.environ.get(nombre)
+    if valor is None or valor.strip() == "":
+        return por_defecto
+    try:
+        return float(valor)
+    except ValueError:
+        return por_defecto
+
+# Límites de la API de Gemini (solicitudes y tokens por minuto)
+LIMITE_RPM = _entero_entorno("ENSAMBLADOR_RPM", 60)
+LIMITE_TPM = _entero_entorno("ENSAMBLADOR_TPM", 1_000_000)
+
+# Número máximo de solicitudes simultáneas en vuelo
+MAX_CONCURRENCIA = _entero_entorno("ENSAMBLADOR_CONCURRENCIA", 8)
+
+# Reintentos con retroceso exponencial ante errores 429/5xx
+MAX_REINTENTOS = _entero_entorno("ENSAMBLADOR_REINTENTOS", 5)
+RETROCESO_BASE_S = _decimal_entorno("ENSAMBLADOR_RETROCESO_BASE", 2.0)
+RETROCESO_MAX_S = _decimal_entorno("ENSAMBLADOR_RETROCESO_MAX", 60.0)
+
+# Ítems por solicitud: 1 = modo por ítem (dos solicitudes por fila); con más,
+# cada solicitud lleva varios ítems y trae análisis y recomendaciones en JSON
+TAMANO_LOTE_PROMPTS = _entero_entorno("ENSAMBLADOR_LOTE_PROMPTS", 1)
+
+# Directorio local para datos persistentes (caché, puntos de control, etc.)
+DIRECTORIO_DATOS = os.environ.get("ENSAMBLADOR_DATOS", os.path.join(os.getcwd(), ".ensamblador"))
+
+# Caché persistente de respuestas del modelo
+RUTA_CACHE = os.path.join(DIRECTORIO_DATOS, "cache_respuestas.sqlite3")
+CACHE_MAX_MB = _entero_entorno("ENSAMBLADOR_CACHE_MAX_MB", 500)
+CACHE_MAX_DIAS = _entero_entorno("ENSAMBLADOR_CACHE_MAX_DIAS", 30)
+
+# Puntos de control de las corridas de enriquecimiento
+RUTA_CORRIDAS = os.path.join(DIRECTORIO_DATOS, "corridas.sqlite3")
+
+# Filas por bloque al leer el Excel de datos base
+TAMANO_BLOQUE_LECTURA = _entero_entorno("ENSAMBLADOR_BLOQUE_LECTURA", 5000)
+
+# Cola persistente de trabajos de enriquecimiento en segundo plano
+RUTA_TRABAJOS = os.path.join(DIRECTORIO_DATOS, "trabajos.sqlite3")
+MAX_TRABAJOS_SIMULTANEOS = _entero_entorno("ENSAMBLADOR_TRABAJOS", 2)
+INTERVALO_PROGRESO_S = _decimal_entorno("ENSAMBLADOR_INTERVALO_PROGRESO", 1.0)
+# Cada proceso renueva el latido de sus trabajos en curso; si deja de hacerlo
+# durante VENCIMIENTO_TRABAJOS_S, otro proceso puede devolverlos a la cola
+LATIDO_TRABAJOS_S = _decimal_entorno("ENSAMBLADOR_LATIDO_TRABAJOS", 10.0)
+VENCIMIENTO_TRABAJOS_S = _decimal_entorno("ENSAMBLADOR_VENCIMIENTO_TRABAJOS", 60.0)
+
+# Ensamblaje de fichas en paralelo
+MAX_PROCESOS_ENSAMBLAJE = _entero_entorno("ENSAMBLADOR_PROCESOS", os.cpu_count() or 1)
+TAMANO_LOTE_ENSAMBLAJE = _entero_entorno("ENSAMBLADOR_LOTE_ENSAMBLAJE", 16)
+
+# Archivos temporales (.zip de fichas, exportaciones) y su limpieza
+DIRECTORIO_TEMPORAL = os.environ.get("ENSAMBLADOR_TEMPORALES", os.path.join(DIRECTORIO_DATOS, "temporales"))
+TEMPORALES_MAX_HORAS = _entero_entorno("ENSAMBLADOR_TEMPORALES_MAX_HORAS", 24)
+
+# Nivel de compresión del .zip: 0 = sin compresión (los .docx ya vienen comprimidos)
+NIVEL_COMPRESION_ZIP = _entero_entorno("ENSAMBLADOR_COMPRESION_ZIP", 0)
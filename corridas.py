@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+
+# --- PUNTOS DE CONTROL DE LAS CORRIDAS DE ENRIQUECIMIENTO ---
+# Cada corrida guarda los datos de entrada ya limpios y el resultado de cada
+# etapa de cada fila en cuanto termina, de modo que una corrida interrumpida
+# (recarga de la pestaña, caída de la sesión, límites de la API) puede
+# reanudarse o reprocesar solo las filas con error.
+
+ETAPAS = ("analisis", "recomendaciones")
+
+# Huella de una clave API: identifica al dueño de corridas y trabajos sin guardar la clave
+def huella_clave(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+# Una etapa falla si hubo excepción o si algún valor quedó marcado como ERROR
+def es_fallido(valores, error):
+    return error is not None or any(str(valor).startswith("ERROR") for valor in valores)
+
+
+class AlmacenCorridas:
+    def __init__(self, ruta=None):
+        self.ruta = ruta or config.RUTA_CORRIDAS
+        self._lock = threading.Lock()
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS corridas ("
+                " run_id TEXT PRIMARY KEY, creado REAL NOT NULL, nombre_archivo TEXT,"
+                " total INTEGER NOT NULL, datos BLOB NOT NULL, clave TEXT)"
+            )
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS filas ("
+                " run_id TEXT NOT NULL, posicion INTEGER NOT NULL, etapa TEXT NOT NULL,"
+                " valores TEXT NOT NULL, error TEXT, fallida INTEGER NOT NULL, actualizado REAL NOT NULL,"
+                " PRIMARY KEY (run_id, posicion, etapa))"
+            )
+            self._conexion.commit()
+
+    # Registra una corrida nueva con los datos de entrada y devuelve su
+    # identificador; `clave` es la huella de la clave API de su dueño
+    def crear_corrida(self, df, nombre_archivo="", clave=None):
+        run_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._conexion.execute(
+                "INSERT INTO corridas (run_id, creado, nombre_archivo, total, datos, clave) VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, time.time(), nombre_archivo, len(df), pickle.dumps(df), clave)
+            )
+            self._conexion.commit()
+        return run_id
+
+    # Si la corrida existe y, con `clave`, si pertenece a esa huella
+    def existe(self, run_id, clave=None):
+        consulta = "SELECT 1 FROM corridas WHERE run_id = ?"
+        parametros = (run_id,)
+        if clave is not None:
+            consulta += " AND clave = ?"
+            parametros += (clave,)
+        with self._lock:
+            return self._conexion.execute(consulta, parametros).fetchone() is not None
+
+    def cargar_datos(self, run_id):
+        with self._lock:
+            fila = self._conexion.execute("SELECT datos FROM corridas WHERE run_id = ?", (run_id,)).fetchone()
+        if fila is None:
+            raise KeyError(f"No existe la corrida '{run_id}'")
+        return pickle.loads(fila[0])
+
+    # Guarda de inmediato el resultado de una etapa de una fila
+    def guardar_etapa(self, run_id, posicion, etapa, valores, error=None):
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO filas (run_id, posicion, etapa, valores, error, fallida, actualizado)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, posicion, etapa, json.dumps(list(valores), ensure_ascii=False),
+                 None if error is None else str(error), int(es_fallido(valores, error)), time.time())
+            )
+            self._conexion.commit()
+
+    # Devuelve {(posicion, etapa): (valores, error)} con todo lo guardado de la corrida
+    def resultados(self, run_id):
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT posicion, etapa, valores, error FROM filas WHERE run_id = ?", (run_id,)
+            ).fetchall()
+        return {(posicion, etapa): (tuple(json.loads(valores)), error) for posicion, etapa, valores, error in filas}
+
+    # Resultados de las `limite` filas que terminaron sus recomendaciones más
+    # recientemente, como {(posicion, etapa): (valores, error)}. Sirve para la
+    # vista previa de una corrida en curso sin cargarla completa.
+    def ultimos_resultados(self, run_id, limite=20):
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT posicion, etapa, valores, error FROM filas WHERE run_id = ? AND posicion IN ("
+                " SELECT posicion FROM filas WHERE run_id = ? AND etapa = 'recomendaciones'"
+                " ORDER BY actualizado DESC LIMIT ?)", (run_id, run_id, limite)
+            ).fetchall()
+        return {(posicion, etapa): (tuple(json.loads(valores)), error) for posicion, etapa, valores, error in filas}
+
+    # Corridas más recientes con su avance y número de filas con error; con
+    # `clave`, solo las de esa huella de clave API
+    def listar_corridas(self, limite=20, clave=None):
+        filtro = "" if clave is None else " WHERE c.clave = ?"
+        parametros = (limite,) if clave is None else (clave, limite)
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT c.run_id, c.creado, c.nombre_archivo, c.total,"
+                " COUNT(DISTINCT CASE WHEN f.etapa = 'recomendaciones' THEN f.posicion END),"
+                " COUNT(DISTINCT CASE WHEN f.fallida = 1 THEN f.posicion END)"
+                f" FROM corridas c LEFT JOIN filas f ON f.run_id = c.run_id{filtro}"
+                " GROUP BY c.run_id ORDER BY c.creado DESC LIMIT ?", parametros
+            ).fetchall()
+        return [
+            {"run_id": run_id, "creado": creado, "nombre_archivo": nombre, "total": total,
+             "completadas": completadas, "fallidas": fallidas}
+            for run_id, creado, nombre, total, completadas, fallidas in filas
+        ]
@@ -0,0 +1,154 @@
+import sys
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+import config
+
+# --- ENSAMBLAJE DE FICHAS EN PARALELO ---
+# Cada proceso recibe los bytes de la plantilla una sola vez. La limpieza del
+# XML (patch_xml) y la compilación de Jinja se hacen solo en la primera ficha
+# de cada proceso; el .docx sí se vuelve a abrir y guardar en cada ficha,
+# porque render() modifica su árbol XML. Las filas se reparten en lotes entre
+# un ProcessPoolExecutor y los documentos se devuelven en el orden original.
+
+# Estado de cada proceso trabajador del pool. Con un solo proceso el estado es
+# local a cada llamada a renderizar_fichas: el proceso de Streamlit lo
+# comparten todas las sesiones, cada una con su propia plantilla.
+_estado_trabajador = None
+
+# Entorno de Jinja que memoriza las plantillas compiladas por su código fuente.
+# docxtpl compila el mismo XML en cada render; con este entorno solo la primera
+# vez paga el costo de compilación.
+def _crear_entorno():
+    from jinja2 import Environment
+    entorno = Environment()
+    compilar = entorno.from_string
+    compiladas = {}
+
+    def from_string(source, *args, **kwargs):
+        plantilla = compiladas.get(source)
+        if plantilla is None:
+            plantilla = compiladas[source] = compilar(source, *args, **kwargs)
+        return plantilla
+
+    entorno.from_string = from_string
+    return entorno
+
+# DocxTemplate que memoriza el XML ya limpiado por patch_xml. Todas las fichas
+# parten del mismo XML (cuerpo, encabezados y pies), así que las expresiones
+# regulares de limpieza se aplican una sola vez por parte.
+def _crear_clase_plantilla():
+    from docxtpl import DocxTemplate
+    parcheados = {}
+
+    class PlantillaParcheada(DocxTemplate):
+        def patch_xml(self, src_xml):
+            parcheado = parcheados.get(src_xml)
+            if parcheado is None:
+                parcheado = parcheados[src_xml] = super().patch_xml(src_xml)
+            return parcheado
+
+    return PlantillaParcheada
+
+# Estado de renderizado de una plantilla: (bytes, entorno de Jinja, clase)
+def _crear_estado(plantilla_bytes):
+    return plantilla_bytes, _crear_entorno(), _crear_clase_plantilla()
+
+def _inicializar_trabajador(plantilla_bytes):
+    global _estado_trabajador
+    _estado_trabajador = _crear_estado(plantilla_bytes)
+
+# Renderiza una ficha a bytes con el estado de una plantilla
+def _renderizar(estado, contexto):
+    plantilla_bytes, entorno, clase_plantilla = estado
+    # Cada documento necesita su propio árbol XML porque render() lo modifica
+    doc = clase_plantilla(BytesIO(plantilla_bytes))
+    doc.render(contexto, entorno)
+    salida = BytesIO()
+    doc.save(salida)
+    return salida.getvalue()
+
+def _renderizar_lote(lote):
+    return [(nombre, _renderizar(_estado_trabajador, contexto)) for nombre, contexto in lote]
+
+# Proceso de spawn que no vuelve a ejecutar el script principal. Bajo
+# Streamlit, __main__ es la página (main.py) y spawn la importaría de nuevo en
+# cada trabajador; mientras el proceso arranca se oculta su __file__, así el
+# hijo solo importa este módulo.
+class _ProcesoSinPrincipal(SpawnProcess):
+    def start(self):
+        principal = sys.modules.get("__main__")
+        ruta = principal.__dict__.pop("__file__", None) if principal is not None else None
+        try:
+            super().start()
+        finally:
+            if ruta is not None:
+                principal.__file__ = ruta
+
+
+class _ContextoSinPrincipal(SpawnContext):
+    Process = _ProcesoSinPrincipal
+
+
+# Variables de Jinja que usa la plantilla de Word
+def variables_plantilla(plantilla_bytes):
+    from docxtpl import DocxTemplate
+    return DocxTemplate(BytesIO(plantilla_bytes)).get_undeclared_template_variables()
+
+# Nombre seguro para el archivo de una ficha dentro del .zip
+def nombre_archivo_ficha(valor):
+    nombre_base = str(valor).replace('/', '_').replace('\\', '_')
+    return f"{nombre_base}.docx"
+
+# Renderiza las fichas `filas` = [(nombre_archivo, contexto), ...] y produce
+# (nombre_archivo, bytes_docx) en el mismo orden. Con un solo proceso se
+# renderiza en el proceso actual; con más, se reparten lotes de `tamano_lote`
+# filas y se mantienen como máximo dos lotes en vuelo por proceso.
+def renderizar_fichas(plantilla_bytes, filas, max_procesos=None, tamano_lote=None):
+    max_procesos = max_procesos or config.MAX_PROCESOS_ENSAMBLAJE
+    tamano_lote = tamano_lote or config.TAMANO_LOTE_ENSAMBLAJE
+    filas = iter(filas)
+
+    if max_procesos <= 1:
+        estado = _crear_estado(plantilla_bytes)
+        for nombre, contexto in filas:
+            yield nombre, _renderizar(estado, contexto)
+        return
+
+    def siguiente_lote():
+        lote = []
+        for fila in filas:
+            lote.append(fila)
+            if len(lote) >= tamano_lote:
+                break
+        return lote
+
+    with ProcessPoolExecutor(max_workers=max_procesos, mp_context=_ContextoSinPrincipal(),
+                             initializer=_inicializar_trabajador, initargs=(plantilla_bytes,)) as executor:
+        en_vuelo = deque()
+        lote = siguiente_lote()
+        while lote or en_vuelo:
+            while lote and len(en_vuelo) < max_procesos * 2:
+                en_vuelo.append(executor.submit(_renderizar_lote, lote))
+                lote = siguiente_lote()
+            for nombre, contenido in en_vuelo.popleft().result():
+                yield nombre, contenido
+
+
+# Escribe las fichas en un .zip en disco a medida que se generan, sin retener
+# el archivo completo en memoria. Con nivel 0 se guardan sin comprimir, ya que
+# los .docx vienen comprimidos; de 1 a 9 se usa deflate con ese nivel.
+# Produce la cantidad de fichas escritas después de cada una.
+def escribir_zip(ruta, fichas, nivel_compresion=None):
+    nivel = config.NIVEL_COMPRESION_ZIP if nivel_compresion is None else nivel_compresion
+    if nivel <= 0:
+        compresion, nivel = zipfile.ZIP_STORED, None
+    else:
+        compresion, nivel = zipfile.ZIP_DEFLATED, min(nivel, 9)
+    with zipfile.ZipFile(ruta, "w", compresion, allowZip64=True, compresslevel=nivel) as zip_file:
+        for cantidad, (nombre, contenido) in enumerate(fichas, start=1):
+            zip_file.writestr(nombre, contenido)
+            yield cantidad
@@ -0,0 +1,89 @@
+import hashlib
+
+import config
+
+# --- LECTURA Y ESCRITURA DE LIBROS DE EXCEL ---
+# La lectura recorre la hoja en modo de solo lectura de openpyxl, por bloques
+# de filas y conservando solo las columnas pedidas. La escritura usa el modo de
+# solo escritura, que vuelca las filas al disco sin armar el libro en memoria.
+
+# Nombres de columna al estilo de pandas: vacías como "Unnamed: i" y
+# repetidas con sufijo ".1", ".2", ...
+def _nombres_columnas(encabezado):
+    nombres = []
+    vistos = {}
+    for indice, valor in enumerate(encabezado):
+        nombre = f"Unnamed: {indice}" if valor is None or str(valor).strip() == "" else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+# Lee la primera hoja de `origen` (ruta o archivo abierto) en un DataFrame.
+# Con `columnas`, solo se conservan las que existan en el libro; las filas
+# totalmente vacías se omiten.
+def leer_libro(origen, columnas=None, tamano_bloque=None):
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    tamano_bloque = tamano_bloque or config.TAMANO_BLOQUE_LECTURA
+    libro = load_workbook(origen, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        nombres = _nombres_columnas(next(filas, ()))
+        pedidas = set(nombres) if columnas is None else set(columnas)
+        indices = [indice for indice, nombre in enumerate(nombres) if nombre in pedidas]
+        nombres = [nombres[indice] for indice in indices]
+        bloques = []
+        bloque = []
+        for fila in filas:
+            valores = tuple(fila[indice] if indice < len(fila) else None for indice in indices)
+            if all(valor is None for valor in valores):
+                continue
+            bloque.append(valores)
+            if len(bloque) >= tamano_bloque:
+                bloques.append(pd.DataFrame(bloque, columns=nombres))
+                bloque = []
+        if bloque or not bloques:
+            bloques.append(pd.DataFrame(bloque, columns=nombres))
+    finally:
+        libro.close()
+    df = pd.concat(bloques, ignore_index=True) if len(bloques) > 1 else bloques[0]
+    # Columnas con enteros y decimales mezclados (2 y 2.5) quedan como float, igual que en pandas
+    return df.infer_objects()
+
+# Escribe el DataFrame en `destino` (ruta o archivo abierto) con el writer de
+# solo escritura de openpyxl; el encabezado va en negrita, como en pandas
+def escribir_libro(df, destino, nombre_hoja="Hoja1"):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(nombre_hoja)
+    negrita = Font(bold=True)
+    encabezado = []
+    for columna in df.columns:
+        celda = WriteOnlyCell(hoja, value=str(columna))
+        celda.font = negrita
+        encabezado.append(celda)
+    hoja.append(encabezado)
+    valores = df.astype(object).where(df.notna(), None)
+    for fila in valores.itertuples(index=False, name=None):
+        hoja.append(fila)
+    libro.save(destino)
+
+# Huella del contenido de un DataFrame (columnas, índice y valores)
+def huella_datos(df):
+    import pandas as pd
+
+    huella = hashlib.sha256("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    try:
+        huella.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        # Celdas con valores no hashables (listas, diccionarios): se usa su texto
+        huella.update(pd.util.hash_pandas_object(df.astype(str), index=True).values.tobytes())
+    return huella.hexdigest()
@@ -0,0 +1,56 @@
+import html
+
+# --- LIMPIEZA DE TEXTO (HTML, ENTIDADES Y ESPACIOS) ---
+# Operaciones vectorizadas de pandas sobre columnas completas. Los patrones se
+# definen una sola vez como texto (no como re.Pattern) para que, con columnas
+# de texto respaldadas por pyarrow, pandas los ejecute en el motor de
+# expresiones regulares de Arrow en lugar de recorrer celda por celda en Python.
+# Solo se limpian las columnas que alimentan los prompts o la plantilla de Word.
+
+PATRON_ETIQUETA = r"<[^>]*>"
+PATRON_ENTIDAD = r"&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);"
+# Solo coincide con lo que hay que cambiar (rachas de espacios o espacios
+# especiales), no con cada espacio simple, lo que abarata mucho el reemplazo
+PATRON_ESPACIOS = r"[ \t\f\v\r\xa0]{2,}|[\t\f\v\r\xa0]"
+PATRON_LINEAS_VACIAS = r"\n{3,}"
+
+# Decodifica las entidades HTML (&nbsp;, &aacute;, ...). Se buscan las entidades
+# distintas presentes y cada una se reemplaza en bloque por su carácter; las que
+# producen '&' van al final para no decodificar dos veces (&amp;lt; -> &lt;).
+def _decodificar_entidades(serie):
+    con_entidades = serie.str.contains("&", regex=False, na=False)
+    if not con_entidades.any():
+        return serie
+    entidades = serie[con_entidades].str.findall(PATRON_ENTIDAD).explode().dropna().unique()
+    for entidad in sorted(entidades, key=lambda entidad: html.unescape(entidad) == "&"):
+        serie = serie.str.replace(entidad, html.unescape(entidad), regex=False)
+    return serie
+
+# Limpia una serie: quita etiquetas HTML, decodifica entidades y normaliza
+# espacios y saltos de línea. Los valores que no son texto se conservan.
+def limpiar_serie(serie):
+    try:
+        textos = serie.str
+    except AttributeError:
+        return serie
+    es_texto = textos.len().notna()
+    if not es_texto.any():
+        return serie
+    limpio = _decodificar_entidades(textos.replace(PATRON_ETIQUETA, "", regex=True))
+    limpio = limpio.str.replace(PATRON_ESPACIOS, " ", regex=True)
+    # Tras colapsar espacios queda como mucho uno a cada lado de un salto de línea
+    limpio = limpio.str.replace(" \n", "\n", regex=False).str.replace("\n ", "\n", regex=False)
+    if limpio.str.contains("\n\n\n", regex=False, na=False).any():
+        limpio = limpio.str.replace(PATRON_LINEAS_VACIAS, "\n\n", regex=True)
+    limpio = limpio.str.strip()
+    return limpio.where(es_texto, serie)
+
+# Limpia en el DataFrame las columnas indicadas que existan; sin `columnas`,
+# limpia todas las columnas de texto
+def limpiar_columnas(df, columnas=None):
+    if columnas is None:
+        columnas = [col for col in df.columns if df[col].dtype == "object" or str(df[col].dtype) in ("str", "string")]
+    for col in columnas:
+        if col in df.columns:
+            df[col] = limpiar_serie(df[col])
+    return df
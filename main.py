@@ -1,12 +1,13 @@
 import streamlit as st
-import pandas as pd
-from docxtpl import DocxTemplate
-import google.generativeai as genai
-import os
-import re
-import time
-import zipfile
-from io import BytesIO
+
+import config
+import pipeline
+from cache import CacheRespuestas
+from corridas import AlmacenCorridas
+from libros import huella_datos
+from metricas import Trazador, perfiladores_disponibles
+from temporales import ArchivoTemporal, limpiar_antiguos
+from trabajos import ESTADOS_ACTIVOS, GestorTrabajos
 
 # --- CONFIGURACIÓN DE LA PÁGINA DE STREAMLIT ---
 st.set_page_config(
@@ -15,161 +16,37 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- FUNCIONES DE LÓGICA ---
-
-# Función para limpiar HTML (de tu código original)
-def limpiar_html(texto_html):
-    if not isinstance(texto_html, str):
-        return texto_html
-    cleanr = re.compile('<.*?>')
-    texto_limpio = re.sub(cleanr, '', texto_html)
-    return texto_limpio
+# --- FUNCIONES DE APOYO DE LA INTERFAZ ---
+# La lógica vive en pipeline.py; esta página solo la presenta.
 
-# Función para configurar el modelo Gemini
+# Función para configurar el backend de Gemini
 def setup_model(api_key):
     try:
-        genai.configure(api_key=api_key)
-        generation_config = {
-            "temperature": 0.6, "top_p": 1, "top_k": 1, "max_output_tokens": 8192
-        }
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro-latest",
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
-        return model
+        return pipeline.setup_model(api_key)
     except Exception as e:
         st.error(f"Error al configurar la API de Google: {e}")
         return None
 
-# Funciones para construir prompts (adaptadas de tu código)
-def construir_prompt_analisis(fila):
-    fila = fila.fillna('')
-    descripcion_item = (
-        f"Enunciado: {fila.get('Enunciado', '')}\n"
-        f"A. {fila.get('OpcionA', '')}\n" # Asegúrate de que el Excel tenga 'OpcionA', 'OpcionB', etc.
-        f"B. {fila.get('OpcionB', '')}\n"
-        f"C. {fila.get('OpcionC', '')}\n"
-        f"D. {fila.get('OpcionD', '')}\n"
-        f"Respuesta correcta: {fila.get('AlternativaClave', '')}"
-    )
-    return f"""
-🎯 ROL DEL SISTEMA
-Eres un experto en evaluación educativa con un profundo conocimiento de la pedagogía urbana, especializado en lectura y procesos cognitivos en el contexto de Bogotá. Tu misión es analizar un ítem de evaluación para proporcionar un análisis tripartito: un resumen de lo que evalúa, la ruta cognitiva detallada para la respuesta correcta, y un análisis de los errores asociados a las opciones incorrectas.
-
-🧠 INSUMOS DE ENTRADA
-- Descripción del Ítem: {descripcion_item}
-- Componente: {fila.get('ComponenteNombre', 'No aplica')}
-- Competencia: {fila.get('CompetenciaNombre', '')}
-- Aprendizaje Priorizado: {fila.get('AfirmacionNombre', '')}
-- Evidencia de Aprendizaje: {fila.get('EvidenciaNombre', '')}
-- Grado Escolar: {fila.get('ItemGradoId', '')}
-- Respuesta correcta: {fila.get('AlternativaClave', 'No aplica')}
-- Opción A: {fila.get('OpcionA', 'No aplica')}
-- Opción B: {fila.get('OpcionB', 'No aplica')}
-- Opción C: {fila.get('OpcionC', 'No aplica')}
-- Opción D: {fila.get('OpcionD', 'No aplica')}
-
-📝 INSTRUCCIONES PARA EL ANÁLISIS DEL ÍTEM
-Genera el análisis del ítem siguiendo estas reglas y en el orden exacto solicitado:
-
-### 1. Qué Evalúa
-**Regla de Oro:** La descripción debe ser una síntesis directa y precisa de la taxonomía del ítem que tiene en cuenta la forma en que se resuelve el ítem.
-- Redacta una única frase (máximo 2 renglones) que comience obligatoriamente con "Este ítem evalúa la capacidad del estudiante para...".
-- La frase debe construirse usando la **Evidencia de Aprendizaje** como núcleo de la habilidad y la **Competencia** como el marco general.
-- **Prohibido** referirse al contenido o a los personajes del texto. 
-
-### 2. Ruta Cognitiva Correcta
-Describe, en un párrafo continuo y de forma impersonal, el procedimiento mental que un estudiante debe ejecutar para llegar a la respuesta correcta.
-- Debes articular la ruta usando **verbos que representen procesos cognitivos** (ej: identificar, relacionar, inferir, comparar, evaluar) para mostrar la secuencia de pensamiento de manera explícita.
-- El último paso de la ruta debe ser la justificación final de por qué la alternativa clave es la única respuesta válida, conectando el razonamiento con la selección de esa opción.
-
-### 3. Análisis de Opciones No Válidas (Distractores)
-Para cada una de las TRES opciones incorrectas, realiza un análisis del error.
-- Primero, identifica la **naturaleza de la confusión** (ej: es una lectura literal cuando se pide inferir, una sobregeneralización, una interpretación de un detalle irrelevante pero llamativo, una opinión personal no sustentada en el texto, etc.).
-- Luego, explica el posible razonamiento que lleva al estudiante a cometer ese error.
-- Finalmente, clarifica por qué esa opción es incorrecta en el contexto de la tarea evaluativa.
-
-✍️ FORMATO DE SALIDA DEL ANÁLISIS
-**REGLA CRÍTICA:** Responde únicamente con el texto solicitado y en la estructura definida a continuación. Es crucial que los tres títulos aparezcan en la respuesta, en el orden correcto y sin texto introductorio, de cierre o conclusiones.
-
-Qué Evalúa:
-Este ítem evalúa la capacidad del estudiante para [síntesis de la taxonomía, centrada en la Evidencia de Aprendizaje y el proceso para resolver el ítem].
-
-Ruta Cognitiva Correcta:
-Para resolver correctamente este ítem, el estudiante primero debe [verbo cognitivo 1]... Luego, necesita [verbo cognitivo 2]... Este proceso le permite [verbo cognitivo 3]..., lo que finalmente lo lleva a concluir que la opción [letra de la respuesta correcta] es la correcta porque [justificación final].
-
-Análisis de Opciones No Válidas:
-- **Opción [Letra del distractor]:** El estudiante podría escoger esta opción si comete un error de [naturaleza de la confusión], lo que lo lleva a pensar que [razonamiento erróneo]. Sin embargo, esto es incorrecto porque [razón clara y concisa].
-- **Opción [Letra del distractor]:** La elección de esta alternativa sugiere una falla en [naturaleza de la confusión]. El estudiante posiblemente cree que [razonamiento erróneo], pero la opción es inválida debido a que [razón clara y concisa].
-- **Opción [Letra del distractor]:** Esta opción funciona como un distractor para quien [naturaleza de la confusión], interpretando erróneamente que [razonamiento erróneo]. Es incorrecta puesto que [razón clara y concisa].
-"""
-
-def construir_prompt_recomendaciones(fila):
-    fila = fila.fillna('')
-    return f"""
-🎯 ROL DEL SISTEMA
-Eres un experto en evaluación educativa con un profundo conocimiento de la pedagogía urbana. Tu misión es generar dos recomendaciones pedagógicas personalizadas a partir de cada ítem de evaluación formativa: una para Fortalecer y otra para Avanzar en el aprendizaje. Deberás identificar de manera endógena los verbos clave de los procesos cognitivos implicados, basándote en la competencia, el aprendizaje priorizado, la evidencia de aprendizaje, la tipología textual (cuando aplique), el grado escolar y el nivel educativo general de los estudiantes. Luego, integrarás estos verbos de forma fluida en la redacción de las recomendaciones. Considerarás las características cognitivas y pedagógicas del ítem y el texto (cuando aplique), así como las particularidades de los estudiantes.
-
-🧠 INSUMOS DE ENTRADA
-- Texto/Fragmento: {fila.get('ItemContexto', 'No aplica')}
-- Descripción del Ítem: {fila.get('ItemEnunciado', 'No aplica')}
-- Componente: {fila.get('ComponenteNombre', 'No aplica')}
-- Competencia: {fila.get('CompetenciaNombre', '')}
-- Aprendizaje Priorizado: {fila.get('AfirmacionNombre', '')}
-- Evidencia de Aprendizaje: {fila.get('EvidenciaNombre', '')}
-- Tipología Textual (Solo para Lectura Crítica): {fila.get('Tipologia Textual', 'No aplica')}
-- Grado Escolar: {fila.get('ItemGradoId', '')}
-- Análisis de Errores Comunes: {fila.get('Analisis_Errores', 'No aplica')}
-- Respuesta correcta: {fila.get('AlternativaClave', 'No aplica')}
-- Opción A: {fila.get('OpcionA', 'No aplica')}
-- Opción B: {fila.get('OpcionB', 'No aplica')}
-- Opción C: {fila.get('OpcionC', 'No aplica')}
-- Opción D: {fila.get('OpcionD', 'No aplica')}
-
-📝 INSTRUCCIONES PARA GENERAR LAS RECOMENDACIONES
-Genera las dos recomendaciones adhiriéndote estrictamente a lo siguiente:
-
-### 1. Recomendación para FORTALECER 💪
-- **Objetivo Central:** Andamiar el proceso cognitivo exacto descrito en la **Evidencia de Aprendizaje**.
-- **Contexto Pedagógico:** La actividad debe ser un microcosmos de dicha evidencia, pero simplificada. Debes **descomponer el proceso cognitivo en pasos manejables**.
-- **Actividad Propuesta:** Diseña una actividad de lectura que sea **novedosa, creativa y lúdica**. **Evita explícitamente ejercicios típicos** como cuestionarios, llenar espacios en blanco o buscar ideas principales de forma tradicional. La actividad debe ser útil para los profesores.
-- **Preguntas Orientadoras:** Formula preguntas que funcionen como un **"paso a paso" del razonamiento**, guiando al estudiante a través del proceso de forma sutil.
-
-### 2. Recomendación para AVANZAR 🚀
-- **Objetivo Central:** Asegurar una **progresión cognitiva clara y directa en la que el estudiante avanza** cuando se compara con la actividad de Fortalecer.
-- **Contexto Pedagógico:** La actividad para Avanzar debe ser la **evolución natural y más compleja de la habilidad trabajada en Fortalecer**. La conexión entre ambas debe ser explícita y lógica.
-- **Actividad Propuesta:** Diseña un desafío intelectual de lectura o análisis comparativo que sea **estimulante y poco convencional**. La actividad debe promover el pensamiento crítico y la transferencia de habilidades de una manera que no sea habitual en el aula.
-- **Preguntas Orientadoras:** Formula preguntas abiertas que exijan **evaluación, síntesis, aplicación o metacognición**, demostrando un salto cualitativo respecto a las preguntas de Fortalecer.
-
-✍️ FORMATO DE SALIDA DE LAS RECOMENDACIONES
-**IMPORTANTE: Responde de forma directa, usando obligatoriamente la siguiente estructura. No añadas texto adicional.**
-- **Redacción Impersonal:** Utiliza siempre una redacción profesional e impersonal (ej. "se sugiere (sin mencionar el docente)", "la tarea consiste en", "se entregan tarjetas").
-- **Sin Conclusiones:** Termina directamente con la lista de preguntas.
-
-RECOMENDACIÓN PARA FORTALECER EL APRENDIZAJE EVALUADO EN EL ÍTEM
-Para fortalecer la habilidad de [verbo clave extraído de la Evidencia de Aprendizaje], se sugiere al docente [descripción de la estrategia de andamiaje para ese proceso exacto].
-Una actividad que se puede hacer es: [Descripción detallada de la actividad novedosa y creativa, que no implica escritura].
-Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
-- [Pregunta 1: Que guíe el primer paso del proceso cognitivo]
-- [Pregunta 2: Que ayude a analizar un componente clave del proceso]
-- [Pregunta 3: Que conduzca a la conclusión del proceso base]
-
-RECOMENDACIÓN PARA AVANZAR EN EL APRENDIZAJE EVALUADO EN EL ÍTEM
-Para avanzar desde [proceso cognitivo de Fortalecer] hacia la habilidad de [verbo clave del proceso cognitivo superior], se sugiere al docente [descripción de la estrategia de complejización].
-Una actividad que se puede hacer es: [Descripción detallada de la actividad estimulante y poco convencional, que no implique escritura].
-Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
-- [Pregunta 1: De análisis o evaluación que requiera un razonamiento más profundo]
-- [Pregunta 2: De aplicación, comparación o transferencia a un nuevo contexto]
-- [Pregunta 3: De metacognición o pensamiento crítico sobre el proceso completo]
-"""
+# Caché de respuestas compartida por todas las sesiones del servidor
+@st.cache_resource
+def obtener_cache():
+    return CacheRespuestas()
 
+# Almacén de puntos de control de las corridas, compartido por todas las sesiones
+@st.cache_resource
+def obtener_almacen():
+    return AlmacenCorridas()
+
+# Cola de trabajos en segundo plano, con sus trabajadores y el limitador de
+# tasa compartido por todas las sesiones
+@st.cache_resource
+def obtener_gestor():
+    return GestorTrabajos(obtener_almacen(), obtener_cache())
+
+# Limpieza periódica de archivos temporales que quedaron de procesos anteriores
+@st.cache_resource(ttl=3600)
+def limpiar_temporales_antiguos():
+    return limpiar_antiguos()
 
 # --- INTERFAZ PRINCIPAL DE STREAMLIT ---
 
@@ -179,13 +56,131 @@ st.markdown("Una aplicación para enriquecer datos pedagógicos y generar fichas
 # Inicializar session_state para guardar los datos entre ejecuciones
 if 'df_enriquecido' not in st.session_state:
     st.session_state.df_enriquecido = None
-if 'zip_buffer' not in st.session_state:
-    st.session_state.zip_buffer = None
+if 'archivo_zip' not in st.session_state:
+    st.session_state.archivo_zip = None
+if 'excel_exportado' not in st.session_state:
+    st.session_state.excel_exportado = None
+if 'run_id' not in st.session_state:
+    st.session_state.run_id = st.query_params.get("corrida")
+if 'trazador' not in st.session_state:
+    st.session_state.trazador = None
+if 'trabajo_id' not in st.session_state:
+    st.session_state.trabajo_id = st.query_params.get("trabajo")
+
+limpiar_temporales_antiguos()
 
 # --- PASO 0: Clave API ---
 st.sidebar.header("🔑 Configuración Obligatoria")
 api_key = st.sidebar.text_input("Ingresa tu Clave API de Google AI", type="password")
 
+gestor = obtener_gestor()
+# La clave queda solo en memoria; registrarla reactiva sus trabajos en cola
+# si el servidor se reinició. Su huella identifica las corridas y trabajos de
+# este usuario: la página solo muestra y carga los suyos.
+clave_usuario = gestor.registrar_clave(api_key) if api_key else None
+
+st.sidebar.header("⚡ Rendimiento de la API")
+max_concurrencia = st.sidebar.number_input("Solicitudes simultáneas", min_value=1, max_value=64, value=config.MAX_CONCURRENCIA)
+# Los límites son un presupuesto global, compartido por todas las sesiones
+st.sidebar.number_input("Límite de solicitudes por minuto (RPM), compartido", min_value=1, value=gestor.limitador.rpm,
+                        key="limite_rpm", on_change=lambda: gestor.limitador.ajustar(rpm=st.session_state.limite_rpm))
+st.sidebar.number_input("Límite de tokens por minuto (TPM), compartido", min_value=1000, value=gestor.limitador.tpm,
+                        step=1000, key="limite_tpm",
+                        on_change=lambda: gestor.limitador.ajustar(tpm=st.session_state.limite_tpm))
+tamano_lote = st.sidebar.number_input(
+    "Ítems por solicitud", min_value=1, max_value=50, value=config.TAMANO_LOTE_PROMPTS,
+    help="Con 1 se hacen dos solicitudes por ítem. Con más, cada solicitud agrupa varios ítems y trae "
+         "análisis y recomendaciones en JSON, con muchas menos solicitudes y tokens de entrada."
+)
+cola = gestor.resumen()
+st.sidebar.caption(f"Trabajos en curso: {cola.get('en_curso', 0)} · En cola: {cola.get('pendiente', 0)}")
+
+st.sidebar.header("🗄️ Caché de Respuestas")
+cache = obtener_cache()
+usar_cache = st.sidebar.checkbox("Usar respuestas guardadas en caché", value=True,
+                                 help="Si se desactiva, se regeneran todas las filas y las respuestas nuevas reemplazan las guardadas.")
+if st.sidebar.button("🗑️ Vaciar caché"):
+    cache.vaciar()
+    st.sidebar.success("Caché vaciada.")
+panel_cache = st.sidebar.empty()
+
+# Muestra los contadores de aciertos/fallos de la caché
+def mostrar_estadisticas_cache():
+    estadisticas = cache.estadisticas()
+    panel_cache.caption(
+        f"Aciertos: {estadisticas['aciertos']} · Fallos: {estadisticas['fallos']} · "
+        f"Entradas: {estadisticas['entradas']} · Tamaño: {estadisticas['bytes'] / (1024 * 1024):.1f} MB"
+    )
+
+mostrar_estadisticas_cache()
+
+st.sidebar.header("📊 Métricas de la Corrida")
+perfiladores = {"Ninguno": None, "cProfile": "cprofile", "pyinstrument": "pyinstrument"}
+perfiladores = {nombre: valor for nombre, valor in perfiladores.items()
+                if valor is None or valor in perfiladores_disponibles()}
+perfilador = perfiladores[st.sidebar.selectbox(
+    "Perfilar el ensamblaje", list(perfiladores),
+    help="Con varios procesos solo se perfila el proceso principal; usa 1 proceso para perfilar el renderizado."
+)]
+panel_metricas = st.sidebar.empty()
+descargas_metricas = st.sidebar.container()
+
+# Muestra el resumen de la corrida actual: tiempos por etapa, latencias,
+# reintentos, tokens y fallos al separar las secciones de las respuestas
+def mostrar_metricas(panel=None):
+    panel = panel or panel_metricas
+    trazador = st.session_state.trazador
+    if trazador is None:
+        panel.caption("Las métricas aparecen al iniciar una corrida.")
+        return
+    resumen = trazador.resumen()
+    etapas = " · ".join(f"{etapa}: {duracion:.1f} s" for etapa, duracion in resumen["etapas"].items())
+    latencia = (f"{resumen['latencia_p50_s'] * 1000:.0f} / {resumen['latencia_p95_s'] * 1000:.0f} ms"
+                if resumen["latencia_p50_s"] is not None else "—")
+    panel.caption(
+        f"{etapas or 'Sin etapas terminadas'}  \n"
+        f"Solicitudes: {resumen['solicitudes']} · Desde caché: {resumen['aciertos_cache']} · "
+        f"Latencia p50/p95: {latencia}  \n"
+        f"Reintentos: {resumen['reintentos']} · Errores de la API: {resumen['errores_api']} · "
+        f"Fallos de formato: {resumen['fallos_parseo']}  \n"
+        f"Tokens de entrada/salida: {resumen['tokens_entrada']} / {resumen['tokens_salida']}"
+    )
+
+mostrar_metricas()
+
+st.sidebar.header("💾 Corridas Guardadas")
+almacen = obtener_almacen()
+corridas = almacen.listar_corridas(clave=clave_usuario) if clave_usuario else []
+reanudar = reprocesar = False
+run_seleccionado = None
+if corridas:
+    descripciones = {
+        corrida["run_id"]: f"{corrida['run_id']} · {corrida['nombre_archivo']} · "
+                           f"{corrida['completadas']}/{corrida['total']} filas · {corrida['fallidas']} con error"
+        for corrida in corridas
+    }
+    ids = list(descripciones)
+    indice = ids.index(st.session_state.run_id) if st.session_state.run_id in ids else 0
+    run_seleccionado = st.sidebar.selectbox("Corrida", ids, index=indice, format_func=descripciones.get)
+    # Una corrida con un trabajo en cola o en curso no se puede volver a enviar
+    en_proceso = gestor.trabajo_activo(run_seleccionado) is not None
+    if en_proceso:
+        st.sidebar.caption("Esta corrida ya tiene un trabajo en cola o en curso.")
+    reanudar = st.sidebar.button("▶️ Reanudar corrida", disabled=not api_key or en_proceso)
+    reprocesar = st.sidebar.button("🔁 Reprocesar solo filas con ERROR", disabled=not api_key or en_proceso)
+elif not api_key:
+    st.sidebar.caption("Ingresa tu clave API para ver tus corridas guardadas.")
+else:
+    st.sidebar.caption("Aún no hay corridas guardadas.")
+
+# Tras una recarga de la pestaña, recupera los resultados de una corrida terminada
+# de este usuario (si la sesión sigue un trabajo, los carga el Paso 2 al terminar)
+if (st.session_state.df_enriquecido is None and not st.session_state.trabajo_id and clave_usuario
+        and st.session_state.run_id and almacen.existe(st.session_state.run_id, clave_usuario)):
+    corrida = next((c for c in corridas if c["run_id"] == st.session_state.run_id), None)
+    if corrida and corrida["completadas"] == corrida["total"]:
+        st.session_state.df_enriquecido = pipeline.cargar_resultados_corrida(almacen, st.session_state.run_id)
+
 # --- PASO 1: Carga de Archivos ---
 st.header("Paso 1: Carga tus Archivos")
 col1, col2 = st.columns(2)
@@ -193,108 +188,142 @@ with col1:
     archivo_excel = st.file_uploader("Sube tu Excel con los datos base", type=["xlsx"])
 with col2:
     archivo_plantilla = st.file_uploader("Sube tu Plantilla de Word", type=["docx"])
+columna_nombre_archivo = st.text_input(
+    "Escribe el nombre de la columna para nombrar los archivos (ej. ItemId)", 
+    value="ItemId"
+)
+# Opcional: con plantilla, del Excel solo se cargan las columnas de los
+# prompts, las variables de la plantilla y la columna de nombres. La carga es
+# más rápida, pero el Excel enriquecido ya no trae las demás columnas.
+solo_columnas_necesarias = st.checkbox(
+    "Cargar solo las columnas necesarias",
+    help="Lee del Excel solo lo que usan los prompts, la plantilla y la columna de nombres. "
+         "Es más rápido con libros grandes, pero el Excel enriquecido que se descarga no incluirá las demás columnas."
+)
 
 # --- PASO 2: Enriquecimiento con IA ---
+# El enriquecimiento corre como trabajo en segundo plano (trabajos.py); la
+# página solo lo encola y consulta su avance, así que recargar la pestaña o
+# tocar otros widgets no lo interrumpe.
+
+# Resumen del plan de la corrida: filas únicas y solicitudes ahorradas
+def mostrar_plan(plan):
+    if plan and plan["filas"]:
+        st.info(
+            f"Plan: {plan['filas']} filas → {plan['unicas']} únicas ({plan['duplicadas']} duplicadas), "
+            f"{plan['solicitudes']} solicitudes en lugar de {plan['solicitudes_sin_plan']}; "
+            f"{plan['textos_compartidos']} textos compartidos por varios ítems, {plan['textos_enviados']} envíos de texto."
+        )
+
+# Consulta periódica del trabajo de esta sesión: barras de progreso y vista
+# previa de las últimas filas terminadas (solo se consultan esas filas, no la
+# corrida completa). Al terminar, recarga la página completa.
+@st.fragment(run_every=2)
+def seguir_trabajo(trabajo_id):
+    trabajo = gestor.estado(trabajo_id)
+    if trabajo is None or trabajo["estado"] not in ESTADOS_ACTIVOS:
+        st.rerun()
+    if trabajo["estado"] == "pendiente":
+        st.info(f"Trabajo `{trabajo_id}` en cola (posición {trabajo['posicion_cola']}).")
+        if not trabajo["clave_disponible"]:
+            st.warning("El servidor se reinició: ingresa de nuevo tu clave API para que el trabajo continúe.")
+    else:
+        mostrar_plan(trabajo["plan"])
+        total = trabajo["total"] or 0
+        st.progress(trabajo["analisis"] / total if total else 0.0,
+                    text=f"Analizando Ítem {trabajo['analisis']}/{total}")
+        st.progress(trabajo["recomendaciones"] / total if total else 0.0,
+                    text=f"Generando Recomendación {trabajo['recomendaciones']}/{total}")
+        st.caption("Últimas filas terminadas")
+        st.dataframe(pipeline.vista_previa_corrida(almacen, trabajo["run_id"]), hide_index=True)
+        mostrar_metricas(st.empty())
+    if st.button("⏹️ Cancelar trabajo"):
+        gestor.cancelar(trabajo_id)
+
+# Muestra el desenlace del trabajo y carga el resultado si terminó
+def mostrar_resultado_trabajo(trabajo):
+    if trabajo["estado"] == "cancelado":
+        st.warning("El trabajo se canceló. Lo ya generado quedó guardado y la corrida puede reanudarse.")
+    elif trabajo["estado"] == "fallido":
+        st.error(f"El trabajo falló: {trabajo['error']}. La corrida puede reanudarse desde la barra lateral.")
+    elif st.session_state.df_enriquecido is None:
+        st.session_state.df_enriquecido = pipeline.cargar_resultados_corrida(almacen, trabajo["run_id"])
+        if trabajo["fallidas"]:
+            st.warning(f"{trabajo['fallidas']} filas terminaron con ERROR. Puedes reprocesarlas desde la barra lateral sin repetir las demás.")
+        st.success("Análisis de Ítems y Recomendaciones generados con éxito.")
+        mostrar_estadisticas_cache()
+        st.balloons()
+
 st.header("Paso 2: Enriquece tus Datos con IA")
-if st.button("🤖 Iniciar Análisis y Generación", disabled=(not api_key or not archivo_excel)):
+trabajo = gestor.estado(st.session_state.trabajo_id) if st.session_state.trabajo_id else None
+# Un trabajo de otra clave (por ejemplo, desde ?trabajo= en un enlace ajeno) no se muestra
+if trabajo is not None and trabajo["clave"] != clave_usuario:
+    trabajo = None
+trabajo_activo = trabajo is not None and trabajo["estado"] in ESTADOS_ACTIVOS
+iniciar = st.button("🤖 Iniciar Análisis y Generación", disabled=(not api_key or not archivo_excel or trabajo_activo))
+if iniciar or reanudar or reprocesar:
     if not api_key:
         st.error("Por favor, ingresa tu clave API en la barra lateral izquierda.")
-    elif not archivo_excel:
+    elif iniciar and not archivo_excel:
         st.warning("Por favor, sube un archivo Excel para continuar.")
-    else:
-        model = setup_model(api_key)
-        if model:
+    elif setup_model(api_key):
+        trazador = Trazador()
+        if iniciar:
             with st.spinner("Procesando archivo Excel y preparando datos..."):
-                df = pd.read_excel(archivo_excel)
-                # Limpieza de HTML
-                for col in df.columns:
-                    if df[col].dtype == 'object':
-                        df[col] = df[col].apply(limpiar_html)
+                plantilla_bytes = archivo_plantilla.getvalue() if archivo_plantilla else None
+                columnas = (pipeline.columnas_necesarias(plantilla_bytes, columna_nombre_archivo)
+                            if solo_columnas_necesarias else None)
+                df = pipeline.cargar_excel(archivo_excel, columnas, trazador=trazador)
+                pipeline.limpiar_datos(df, plantilla_bytes, trazador=trazador)
                 st.success("Datos limpios y listos para el análisis.")
-
-            total_filas = len(df)
-            
-            # Proceso de Análisis
-            with st.spinner("Generando Análisis de Ítems... Esto puede tardar varios minutos."):
-                que_evalua_lista, just_correcta_lista, an_distractores_lista = [], [], []
-                progress_bar_analisis = st.progress(0, text="Iniciando Análisis...")
-                for i, fila in df.iterrows():
-                    prompt = construir_prompt_analisis(fila)
-                    try:
-                        response = model.generate_content(prompt)
-                        texto_completo = response.text.strip()
-                        # Separación robusta
-                        header_que_evalua = "Qué Evalúa:"
-                        header_correcta = "Ruta Cognitiva Correcta:"
-                        header_distractores = "Análisis de Opciones No Válidas:"
-                        idx_correcta = texto_completo.find(header_correcta)
-                        idx_distractores = texto_completo.find(header_distractores)
-                        que_evalua = texto_completo[len(header_que_evalua):idx_correcta].strip() if idx_correcta != -1 else texto_completo
-                        just_correcta = texto_completo[idx_correcta:idx_distractores].strip() if idx_correcta != -1 and idx_distractores != -1 else (texto_completo[idx_correcta:].strip() if idx_correcta != -1 else "ERROR")
-                        an_distractores = texto_completo[idx_distractores:].strip() if idx_distractores != -1 else "ERROR"
-                    except Exception as e:
-                        st.warning(f"Error en fila {i+1} (Análisis): {e}")
-                        que_evalua, just_correcta, an_distractores = "ERROR API", "ERROR API", "ERROR API"
-                    
-                    que_evalua_lista.append(que_evalua)
-                    just_correcta_lista.append(just_correcta)
-                    an_distractores_lista.append(an_distractores)
-                    progress_bar_analisis.progress((i + 1) / total_filas, text=f"Analizando Ítem {i+1}/{total_filas}")
-                    time.sleep(1) # Control de velocidad de la API
-                
-                df["Que_Evalua"] = que_evalua_lista
-                df["Justificacion_Correcta"] = just_correcta_lista
-                df["Analisis_Distractores"] = an_distractores_lista
-                st.success("Análisis de Ítems completado.")
-
-            # Proceso de Recomendaciones
-            with st.spinner("Generando Recomendaciones Pedagógicas... Esto también puede tardar."):
-                fortalecer_lista, avanzar_lista = [], []
-                progress_bar_recom = st.progress(0, text="Iniciando Recomendaciones...")
-                for i, fila in df.iterrows():
-                    prompt = construir_prompt_recomendaciones(fila)
-                    try:
-                        response = model.generate_content(prompt)
-                        texto_completo = response.text.strip()
-                        # Separación robusta
-                        titulo_avanzar = "RECOMENDACIÓN PARA AVANZAR"
-                        idx_avanzar = texto_completo.upper().find(titulo_avanzar)
-                        if idx_avanzar != -1:
-                            fortalecer = texto_completo[:idx_avanzar].strip()
-                            avanzar = texto_completo[idx_avanzar:].strip()
-                        else:
-                            fortalecer, avanzar = texto_completo, "ERROR: No se encontró 'AVANZAR'"
-                    except Exception as e:
-                        st.warning(f"Error en fila {i+1} (Recomendaciones): {e}")
-                        fortalecer, avanzar = "ERROR API", "ERROR API"
-                    
-                    fortalecer_lista.append(fortalecer)
-                    avanzar_lista.append(avanzar)
-                    progress_bar_recom.progress((i + 1) / total_filas, text=f"Generando Recomendación {i+1}/{total_filas}")
-                    time.sleep(1) # Control de velocidad
-
-                df["Recomendacion_Fortalecer"] = fortalecer_lista
-                df["Recomendacion_Avanzar"] = avanzar_lista
-                st.success("Recomendaciones generadas con éxito.")
-            
-            # Guardar el resultado en el estado de la sesión
-            st.session_state.df_enriquecido = df
-            st.balloons()
+            run_id = almacen.crear_corrida(df, archivo_excel.name, clave=clave_usuario)
+        else:
+            run_id = run_seleccionado
+        trazador.run_id = run_id
+        trabajo_id = gestor.enviar(
+            run_id, api_key, reprocesar_fallidas=reprocesar, leer_cache=usar_cache,
+            max_concurrencia=max_concurrencia, tamano_lote=tamano_lote, trazador=trazador
+        )
+        st.session_state.trazador = trazador
+        st.session_state.trabajo_id = trabajo_id
+        st.session_state.run_id = run_id
+        st.session_state.df_enriquecido = None
+        st.query_params["corrida"] = run_id
+        st.query_params["trabajo"] = trabajo_id
+        trabajo = gestor.estado(trabajo_id)
+        trabajo_activo = True
+
+if trabajo is not None:
+    st.caption(f"Identificador de la corrida: `{trabajo['run_id']}` (permite reanudarla si la sesión se interrumpe)")
+    if st.session_state.trazador is None:
+        st.session_state.trazador = gestor.trazador(trabajo["trabajo_id"])
+    if trabajo_activo:
+        seguir_trabajo(trabajo["trabajo_id"])
+    else:
+        mostrar_resultado_trabajo(trabajo)
 
 # --- PASO 3: Vista Previa y Verificación ---
 if st.session_state.df_enriquecido is not None:
     st.header("Paso 3: Verifica los Datos Enriquecidos")
     st.dataframe(st.session_state.df_enriquecido.head())
     
-    # Opción para descargar el Excel enriquecido
-    output_excel = BytesIO()
-    with pd.ExcelWriter(output_excel, engine='openpyxl') as writer:
-        st.session_state.df_enriquecido.to_excel(writer, index=False, sheet_name='Datos Enriquecidos')
-    output_excel.seek(0)
+    # El Excel se exporta una sola vez por resultado; las recargas de la página
+    # reutilizan el archivo mientras la huella del contenido no cambie y el
+    # archivo siga en disco
+    huella = huella_datos(st.session_state.df_enriquecido)
+    if (st.session_state.excel_exportado is None or st.session_state.excel_exportado[0] != huella
+            or not st.session_state.excel_exportado[1].existe()):
+        if st.session_state.excel_exportado is not None:
+            st.session_state.excel_exportado[1].eliminar()
+        archivo_excel_enriquecido = ArchivoTemporal(sufijo=".xlsx")
+        with st.spinner("Exportando el Excel enriquecido..."):
+            pipeline.exportar_excel(st.session_state.df_enriquecido, archivo_excel_enriquecido.ruta,
+                                    trazador=st.session_state.trazador)
+        st.session_state.excel_exportado = (huella, archivo_excel_enriquecido)
     
     st.download_button(
         label="📥 Descargar Excel Enriquecido",
-        data=output_excel,
+        data=st.session_state.excel_exportado[1].abrir,
         file_name="excel_enriquecido_con_ia.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -305,9 +334,12 @@ if st.session_state.df_enriquecido is not None:
     if not archivo_plantilla:
         st.warning("Por favor, sube una plantilla de Word para continuar con el ensamblaje.")
     else:
-        columna_nombre_archivo = st.text_input(
-            "Escribe el nombre de la columna para nombrar los archivos (ej. ItemId)", 
-            value="ItemId"
+        procesos_ensamblaje = st.number_input(
+            "Procesos para el ensamblaje", min_value=1, max_value=64, value=config.MAX_PROCESOS_ENSAMBLAJE
+        )
+        nivel_compresion = st.slider(
+            "Nivel de compresión del .zip", min_value=0, max_value=9, value=config.NIVEL_COMPRESION_ZIP,
+            help="0 guarda las fichas sin comprimir (más rápido; los .docx ya vienen comprimidos)."
         )
         
         if st.button("📄 Ensamblar Fichas Técnicas", type="primary"):
@@ -316,36 +348,56 @@ if st.session_state.df_enriquecido is not None:
                 st.error(f"La columna '{columna_nombre_archivo}' no existe en el Excel. Por favor, elige una de: {', '.join(df_final.columns)}")
             else:
                 with st.spinner("Ensamblando todas las fichas en un archivo .zip..."):
-                    plantilla_bytes = BytesIO(archivo_plantilla.getvalue())
-                    zip_buffer = BytesIO()
+                    # El .zip se escribe en disco a medida que llegan las fichas
+                    if st.session_state.archivo_zip is not None:
+                        st.session_state.archivo_zip.eliminar()
+                        st.session_state.archivo_zip = None
+                    archivo_zip = ArchivoTemporal(sufijo=".zip")
+                    
+                    if st.session_state.trazador is None:
+                        st.session_state.trazador = Trazador(st.session_state.run_id)
+                    trazador = st.session_state.trazador
                     
-                    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-                        total_docs = len(df_final)
-                        progress_bar_zip = st.progress(0, text="Iniciando ensamblaje...")
-                        for i, fila in df_final.iterrows():
-                            doc = DocxTemplate(plantilla_bytes)
-                            contexto = fila.to_dict()
-                            doc.render(contexto)
-                            
-                            doc_buffer = BytesIO()
-                            doc.save(doc_buffer)
-                            doc_buffer.seek(0)
-                            
-                            nombre_base = str(fila[columna_nombre_archivo]).replace('/', '_').replace('\\', '_')
-                            nombre_archivo_salida = f"{nombre_base}.docx"
-                            
-                            zip_file.writestr(nombre_archivo_salida, doc_buffer.getvalue())
-                            progress_bar_zip.progress((i + 1) / total_docs, text=f"Añadiendo ficha {i+1}/{total_docs} al .zip")
+                    progress_bar_zip = st.progress(0, text="Iniciando ensamblaje...")
+                    pipeline.ensamblar_zip(
+                        df_final, archivo_plantilla.getvalue(), columna_nombre_archivo, archivo_zip.ruta,
+                        max_procesos=procesos_ensamblaje, nivel_compresion=nivel_compresion,
+                        al_progresar=lambda i, total_docs: progress_bar_zip.progress(i / total_docs, text=f"Añadiendo ficha {i}/{total_docs} al .zip"),
+                        trazador=trazador, perfilador=perfilador
+                    )
                     
-                    st.session_state.zip_buffer = zip_buffer
+                    st.session_state.archivo_zip = archivo_zip
                     st.success("¡Ensamblaje completado!")
 
 # --- PASO 5: Descarga Final ---
-if st.session_state.zip_buffer:
+# Si el .zip desapareció del disco, se descarta y hay que volver a ensamblar
+if st.session_state.archivo_zip and not st.session_state.archivo_zip.existe():
+    st.session_state.archivo_zip.eliminar()
+    st.session_state.archivo_zip = None
+    st.warning("El archivo .zip ya no está disponible. Vuelve a ensamblar las fichas.")
+if st.session_state.archivo_zip:
     st.header("Paso 5: Descarga el Resultado Final")
+    st.caption(f"Tamaño del archivo: {st.session_state.archivo_zip.tamano() / (1024 * 1024):.1f} MB")
+    # El archivo se abre solo cuando se pulsa el botón. Streamlit no transmite
+    # descargas por partes: lee el archivo completo y guarda esa única copia en
+    # memoria mientras la descarga esté disponible, así que el pico de memoria
+    # de este paso es el tamaño del .zip.
     st.download_button(
         label="📥 Descargar TODAS las fichas (.zip)",
-        data=st.session_state.zip_buffer,
+        data=st.session_state.archivo_zip.abrir,
         file_name="fichas_tecnicas_generadas.zip",
         mime="application/zip"
     )
+
+# --- MÉTRICAS: resumen final, exportación y perfil ---
+if st.session_state.trazador is not None:
+    trazador = st.session_state.trazador
+    mostrar_metricas()
+    nombre_metricas = f"metricas_{trazador.run_id or 'corrida'}"
+    descargas_metricas.download_button("📥 Métricas (JSON)", data=trazador.exportar_json(),
+                                       file_name=f"{nombre_metricas}.json", mime="application/json")
+    descargas_metricas.download_button("📥 Eventos (CSV)", data=trazador.exportar_csv(),
+                                       file_name=f"{nombre_metricas}.csv", mime="text/csv")
+    if trazador.perfil:
+        with st.expander("🔬 Perfil del ensamblaje"):
+            st.code(trazador.perfil)
@@ -0,0 +1,123 @@
+import csv
+import importlib.util
+import io
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# --- INSTRUMENTACIÓN Y MÉTRICAS DE LAS CORRIDAS ---
+# El Trazador acumula eventos de una corrida (duración de cada etapa, tiempo
+# por fila, latencia de cada solicitud, reintentos, tokens y fallos al separar
+# las secciones de la respuesta) y los resume o exporta en CSV/JSON.
+
+CAMPOS_CSV = ["t", "tipo", "etapa", "posicion", "duracion", "reintentos", "tokens_entrada",
+              "tokens_salida", "cache", "error", "items"]
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+class Trazador:
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        self.eventos = []
+        self.perfil = None
+        self._inicio = time.time()
+        self._lock = threading.Lock()
+
+    # Registra un evento; `tipo` es "etapa", "fila", "solicitud" o "fallo_parseo"
+    def registrar(self, tipo, **datos):
+        evento = dict(datos, tipo=tipo, t=round(time.time() - self._inicio, 4))
+        with self._lock:
+            self.eventos.append(evento)
+
+    # Mide la duración total de una etapa del pipeline
+    @contextmanager
+    def etapa(self, nombre, items=None):
+        inicio = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.registrar("etapa", etapa=nombre, duracion=time.perf_counter() - inicio, items=items)
+
+    def _de_tipo(self, tipo):
+        with self._lock:
+            return [evento for evento in self.eventos if evento["tipo"] == tipo]
+
+    def resumen(self):
+        solicitudes = self._de_tipo("solicitud")
+        llamadas = [s for s in solicitudes if s.get("cache") != "acierto"]
+        latencias = [s["duracion"] for s in llamadas]
+        filas = self._de_tipo("fila")
+        return {
+            "run_id": self.run_id,
+            "etapas": {e["etapa"]: round(e["duracion"], 3) for e in self._de_tipo("etapa")},
+            "filas_por_etapa": {
+                etapa: len([f for f in filas if f["etapa"] == etapa])
+                for etapa in sorted({f["etapa"] for f in filas})
+            },
+            "solicitudes": len(llamadas),
+            "aciertos_cache": len(solicitudes) - len(llamadas),
+            "latencia_p50_s": _percentil(latencias, 50),
+            "latencia_p95_s": _percentil(latencias, 95),
+            "reintentos": sum(s.get("reintentos") or 0 for s in llamadas),
+            "errores_api": len([s for s in llamadas if s.get("error")]),
+            "tokens_entrada": sum(s.get("tokens_entrada") or 0 for s in llamadas),
+            "tokens_salida": sum(s.get("tokens_salida") or 0 for s in llamadas),
+            "fallos_parseo": len(self._de_tipo("fallo_parseo")),
+        }
+
+    def exportar_json(self):
+        with self._lock:
+            eventos = list(self.eventos)
+        return json.dumps({"resumen": self.resumen(), "eventos": eventos}, ensure_ascii=False, indent=2, default=str)
+
+    def exportar_csv(self):
+        salida = io.StringIO()
+        escritor = csv.DictWriter(salida, fieldnames=CAMPOS_CSV, extrasaction="ignore")
+        escritor.writeheader()
+        with self._lock:
+            escritor.writerows(self.eventos)
+        return salida.getvalue()
+
+
+# Perfiladores instalados: cProfile siempre; pyinstrument es una dependencia opcional
+def perfiladores_disponibles():
+    disponibles = ["cprofile"]
+    if importlib.util.find_spec("pyinstrument") is not None:
+        disponibles.append("pyinstrument")
+    return disponibles
+
+# Perfilador opcional para una etapa: "cprofile", "pyinstrument" o None.
+# El informe de texto queda en `trazador.perfil` al salir del bloque. Si
+# pyinstrument no está instalado se usa cProfile.
+@contextmanager
+def perfilar(herramienta, trazador):
+    if not herramienta:
+        yield
+        return
+    if herramienta == "pyinstrument" and herramienta in perfiladores_disponibles():
+        from pyinstrument import Profiler
+        perfilador = Profiler()
+        perfilador.start()
+        try:
+            yield
+        finally:
+            perfilador.stop()
+            trazador.perfil = perfilador.output_text(unicode=True)
+        return
+    import cProfile
+    import pstats
+    perfilador = cProfile.Profile()
+    perfilador.enable()
+    try:
+        yield
+    finally:
+        perfilador.disable()
+        salida = io.StringIO()
+        pstats.Stats(perfilador, stream=salida).sort_stats("cumulative").print_stats(40)
+        trazador.perfil = salida.getvalue()
@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+
+# --- MOTOR DE EJECUCIÓN CONCURRENTE ---
+# Mantiene varias solicitudes a la API en vuelo a la vez, respetando los
+# límites de solicitudes y tokens por minuto, y reintenta con retroceso
+# exponencial cuando la API responde con 429 o errores 5xx.
+
+# Estimación aproximada de tokens (≈ 4 caracteres por token)
+def estimar_tokens(texto):
+    return max(1, len(texto) // 4)
+
+
+# Limitador de cubeta de tokens para solicitudes/minuto y tokens/minuto.
+# Cuando varias claves lo comparten, el cupo se concede por turnos entre las
+# claves que esperan, de modo que cada una recibe la misma parte del
+# presupuesto sin importar cuántas solicitudes tenga en vuelo.
+class LimitadorTasa:
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm or config.LIMITE_RPM
+        self.tpm = tpm or config.LIMITE_TPM
+        self._solicitudes = float(self.rpm)
+        self._tokens = float(self.tpm)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self._condicion = threading.Condition(self._lock)
+        self._esperando = {}
+        self._ultima_clave = None
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        transcurrido = ahora - self._ultimo
+        self._ultimo = ahora
+        self._solicitudes = min(self.rpm, self._solicitudes + transcurrido * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + transcurrido * self.tpm / 60.0)
+
+    # Clave a la que le toca el siguiente cupo (la que sigue a la última
+    # atendida entre las que esperan; el _lock debe estar tomado)
+    def _clave_en_turno(self):
+        claves = sorted(self._esperando)
+        return next((c for c in claves if self._ultima_clave is None or c > self._ultima_clave), claves[0])
+
+    # Cambia los límites en caliente (el limitador puede estar compartido)
+    def ajustar(self, rpm=None, tpm=None):
+        with self._condicion:
+            self._recargar()
+            self.rpm = rpm or self.rpm
+            self.tpm = tpm or self.tpm
+            self._solicitudes = min(self._solicitudes, self.rpm)
+            self._tokens = min(self._tokens, self.tpm)
+            self._condicion.notify_all()
+
+    # Vista del limitador que adquiere siempre a nombre de `clave`
+    def para_clave(self, clave):
+        return _CuotaClave(self, clave)
+
+    # Bloquea hasta que haya cupo para una solicitud de `tokens` tokens y le
+    # toque el turno a `clave`
+    def adquirir(self, tokens=1, clave=""):
+        with self._condicion:
+            self._esperando[clave] = self._esperando.get(clave, 0) + 1
+            try:
+                while True:
+                    self._recargar()
+                    necesarios = min(tokens, self.tpm)
+                    if self._clave_en_turno() != clave:
+                        self._condicion.wait(timeout=1.0)
+                        continue
+                    if self._solicitudes >= 1 and self._tokens >= necesarios:
+                        self._solicitudes -= 1
+                        self._tokens -= necesarios
+                        self._ultima_clave = clave
+                        return
+                    espera_sol = max(0.0, (1 - self._solicitudes) * 60.0 / self.rpm)
+                    espera_tok = max(0.0, (necesarios - self._tokens) * 60.0 / self.tpm)
+                    self._condicion.wait(timeout=max(espera_sol, espera_tok, 0.01))
+            finally:
+                self._esperando[clave] -= 1
+                if not self._esperando[clave]:
+                    del self._esperando[clave]
+                self._condicion.notify_all()
+
+
+# Cuota de una clave dentro de un LimitadorTasa compartido
+class _CuotaClave:
+    def __init__(self, limitador, clave):
+        self._limitador = limitador
+        self._clave = clave
+
+    def adquirir(self, tokens=1):
+        self._limitador.adquirir(tokens, self._clave)
+
+
+# Determina si un error de la API merece reintento (429 o 5xx)
+def es_error_reintentable(error):
+    for atributo in ("code", "status_code", "status"):
+        codigo = getattr(error, atributo, None)
+        try:
+            codigo = int(codigo)
+        except (TypeError, ValueError):
+            continue
+        return codigo == 429 or 500 <= codigo < 600
+    mensaje = str(error).lower()
+    return any(marca in mensaje for marca in ("429", "resource has been exhausted", "quota", "503", "500 internal", "unavailable"))
+
+
+# Llama a `funcion(prompt)` respetando el limitador y reintentando con
+# retroceso exponencial con jitter completo ante errores transitorios.
+# `al_reintentar(intento, error)` se invoca antes de cada reintento.
+def llamar_con_reintentos(funcion, prompt, limitador=None, max_reintentos=None,
+                          base=None, maximo=None, al_reintentar=None):
+    max_reintentos = config.MAX_REINTENTOS if max_reintentos is None else max_reintentos
+    base = config.RETROCESO_BASE_S if base is None else base
+    maximo = config.RETROCESO_MAX_S if maximo is None else maximo
+    intento = 0
+    while True:
+        if limitador is not None:
+            limitador.adquirir(estimar_tokens(prompt))
+        try:
+            return funcion(prompt)
+        except Exception as e:
+            if intento >= max_reintentos or not es_error_reintentable(e):
+                raise
+            if al_reintentar is not None:
+                al_reintentar(intento + 1, e)
+            time.sleep(random.uniform(0, min(maximo, base * (2 ** intento))))
+            intento += 1
+
+
+# Ejecuta una cadena de etapas por elemento. La etapa k+1 de un elemento se
+# lanza en cuanto termina su etapa k, sin esperar al resto de elementos; cada
+# etapa se llama como `etapa(item, resultados_previos)`. Las etapas pendientes
+# de elementos ya iniciados tienen prioridad sobre elementos nuevos, de modo que
+# los resultados completos fluyen desde el principio de la ejecución.
+# `al_progresar(posicion, numero_etapa, resultados_item)` se invoca desde el hilo
+# que llama al terminar cada etapa. Devuelve los resultados en el orden original.
+def ejecutar_pipeline(items, etapas, max_concurrencia=None, al_progresar=None):
+    items = list(items)
+    resultados = [[] for _ in items]
+    max_concurrencia = max_concurrencia or config.MAX_CONCURRENCIA
+    nuevos = deque(range(len(items)))
+    listos = deque()
+    en_vuelo = {}
+    with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+        while nuevos or listos or en_vuelo:
+            while len(en_vuelo) < max_concurrencia and (listos or nuevos):
+                posicion = listos.popleft() if listos else nuevos.popleft()
+                numero_etapa = len(resultados[posicion])
+                futuro = executor.submit(etapas[numero_etapa], items[posicion], list(resultados[posicion]))
+                en_vuelo[futuro] = posicion
+            terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                posicion = en_vuelo.pop(futuro)
+                resultados[posicion].append(futuro.result())
+                if al_progresar is not None:
+                    al_progresar(posicion, len(resultados[posicion]) - 1, resultados[posicion])
+                if len(resultados[posicion]) < len(etapas):
+                    listos.append(posicion)
+    return resultados
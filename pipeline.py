@@ -0,0 +1,651 @@
+import json
+import time
+from contextlib import nullcontext
+from functools import partial
+
+from backends import BackendGemini
+from cache import clave_cache
+from corridas import ETAPAS, es_fallido
+from ensamblaje import escribir_zip, nombre_archivo_ficha, renderizar_fichas, variables_plantilla
+from libros import escribir_libro, leer_libro
+from limpieza import limpiar_columnas
+from metricas import perfilar
+from planificacion import normalizar, planificar
+import config
+from motor import ejecutar_pipeline, llamar_con_reintentos
+
+# --- PIPELINE DE ENRIQUECIMIENTO Y ENSAMBLAJE (SIN INTERFAZ) ---
+# Cargar → limpiar → analizar → recomendar → exportar Excel → ensamblar .zip.
+# Lo usan tanto la página de Streamlit como la línea de comandos (cli.py).
+# Las dependencias pesadas (pandas, google.generativeai, docxtpl) se importan
+# dentro de las funciones que las necesitan.
+
+# Backend de Gemini listo para usar; los errores se propagan a quien llama
+def setup_model(api_key):
+    return BackendGemini(api_key)
+
+# Columnas del Excel que leen los prompts de análisis y de recomendaciones
+COLUMNAS_PROMPT = [
+    "Enunciado", "ItemEnunciado", "ItemContexto", "OpcionA", "OpcionB", "OpcionC", "OpcionD",
+    "AlternativaClave", "ComponenteNombre", "CompetenciaNombre", "AfirmacionNombre",
+    "EvidenciaNombre", "Tipologia Textual", "ItemGradoId", "Analisis_Errores",
+]
+
+# Reglas de cada tarea, compartidas por los prompts por ítem y por lotes
+INSTRUCCIONES_ANALISIS = """📝 INSTRUCCIONES PARA EL ANÁLISIS DEL ÍTEM
+Genera el análisis del ítem siguiendo estas reglas y en el orden exacto solicitado:
+
+### 1. Qué Evalúa
+**Regla de Oro:** La descripción debe ser una síntesis directa y precisa de la taxonomía del ítem que tiene en cuenta la forma en que se resuelve el ítem.
+- Redacta una única frase (máximo 2 renglones) que comience obligatoriamente con "Este ítem evalúa la capacidad del estudiante para...".
+- La frase debe construirse usando la **Evidencia de Aprendizaje** como núcleo de la habilidad y la **Competencia** como el marco general.
+- **Prohibido** referirse al contenido o a los personajes del texto. 
+
+### 2. Ruta Cognitiva Correcta
+Describe, en un párrafo continuo y de forma impersonal, el procedimiento mental que un estudiante debe ejecutar para llegar a la respuesta correcta.
+- Debes articular la ruta usando **verbos que representen procesos cognitivos** (ej: identificar, relacionar, inferir, comparar, evaluar) para mostrar la secuencia de pensamiento de manera explícita.
+- El último paso de la ruta debe ser la justificación final de por qué la alternativa clave es la única respuesta válida, conectando el razonamiento con la selección de esa opción.
+
+### 3. Análisis de Opciones No Válidas (Distractores)
+Para cada una de las TRES opciones incorrectas, realiza un análisis del error.
+- Primero, identifica la **naturaleza de la confusión** (ej: es una lectura literal cuando se pide inferir, una sobregeneralización, una interpretación de un detalle irrelevante pero llamativo, una opinión personal no sustentada en el texto, etc.).
+- Luego, explica el posible razonamiento que lleva al estudiante a cometer ese error.
+- Finalmente, clarifica por qué esa opción es incorrecta en el contexto de la tarea evaluativa.
+
+"""
+
+INSTRUCCIONES_RECOMENDACIONES = """📝 INSTRUCCIONES PARA GENERAR LAS RECOMENDACIONES
+Genera las dos recomendaciones adhiriéndote estrictamente a lo siguiente:
+
+### 1. Recomendación para FORTALECER 💪
+- **Objetivo Central:** Andamiar el proceso cognitivo exacto descrito en la **Evidencia de Aprendizaje**.
+- **Contexto Pedagógico:** La actividad debe ser un microcosmos de dicha evidencia, pero simplificada. Debes **descomponer el proceso cognitivo en pasos manejables**.
+- **Actividad Propuesta:** Diseña una actividad de lectura que sea **novedosa, creativa y lúdica**. **Evita explícitamente ejercicios típicos** como cuestionarios, llenar espacios en blanco o buscar ideas principales de forma tradicional. La actividad debe ser útil para los profesores.
+- **Preguntas Orientadoras:** Formula preguntas que funcionen como un **"paso a paso" del razonamiento**, guiando al estudiante a través del proceso de forma sutil.
+
+### 2. Recomendación para AVANZAR 🚀
+- **Objetivo Central:** Asegurar una **progresión cognitiva clara y directa en la que el estudiante avanza** cuando se compara con la actividad de Fortalecer.
+- **Contexto Pedagógico:** La actividad para Avanzar debe ser la **evolución natural y más compleja de la habilidad trabajada en Fortalecer**. La conexión entre ambas debe ser explícita y lógica.
+- **Actividad Propuesta:** Diseña un desafío intelectual de lectura o análisis comparativo que sea **estimulante y poco convencional**. La actividad debe promover el pensamiento crítico y la transferencia de habilidades de una manera que no sea habitual en el aula.
+- **Preguntas Orientadoras:** Formula preguntas abiertas que exijan **evaluación, síntesis, aplicación o metacognición**, demostrando un salto cualitativo respecto a las preguntas de Fortalecer.
+
+"""
+
+# Funciones para construir prompts (adaptadas de tu código)
+def construir_prompt_analisis(fila):
+    fila = fila.fillna('')
+    descripcion_item = (
+        f"Enunciado: {fila.get('Enunciado', '')}\n"
+        f"A. {fila.get('OpcionA', '')}\n" # Asegúrate de que el Excel tenga 'OpcionA', 'OpcionB', etc.
+        f"B. {fila.get('OpcionB', '')}\n"
+        f"C. {fila.get('OpcionC', '')}\n"
+        f"D. {fila.get('OpcionD', '')}\n"
+        f"Respuesta correcta: {fila.get('AlternativaClave', '')}"
+    )
+    return f"""
+🎯 ROL DEL SISTEMA
+Eres un experto en evaluación educativa con un profundo conocimiento de la pedagogía urbana, especializado en lectura y procesos cognitivos en el contexto de Bogotá. Tu misión es analizar un ítem de evaluación para proporcionar un análisis tripartito: un resumen de lo que evalúa, la ruta cognitiva detallada para la respuesta correcta, y un análisis de los errores asociados a las opciones incorrectas.
+
+🧠 INSUMOS DE ENTRADA
+- Descripción del Ítem: {descripcion_item}
+- Componente: {fila.get('ComponenteNombre', 'No aplica')}
+- Competencia: {fila.get('CompetenciaNombre', '')}
+- Aprendizaje Priorizado: {fila.get('AfirmacionNombre', '')}
+- Evidencia de Aprendizaje: {fila.get('EvidenciaNombre', '')}
+- Grado Escolar: {fila.get('ItemGradoId', '')}
+- Respuesta correcta: {fila.get('AlternativaClave', 'No aplica')}
+- Opción A: {fila.get('OpcionA', 'No aplica')}
+- Opción B: {fila.get('OpcionB', 'No aplica')}
+- Opción C: {fila.get('OpcionC', 'No aplica')}
+- Opción D: {fila.get('OpcionD', 'No aplica')}
+
+{INSTRUCCIONES_ANALISIS}✍️ FORMATO DE SALIDA DEL ANÁLISIS
+**REGLA CRÍTICA:** Responde únicamente con el texto solicitado y en la estructura definida a continuación. Es crucial que los tres títulos aparezcan en la respuesta, en el orden correcto y sin texto introductorio, de cierre o conclusiones.
+
+Qué Evalúa:
+Este ítem evalúa la capacidad del estudiante para [síntesis de la taxonomía, centrada en la Evidencia de Aprendizaje y el proceso para resolver el ítem].
+
+Ruta Cognitiva Correcta:
+Para resolver correctamente este ítem, el estudiante primero debe [verbo cognitivo 1]... Luego, necesita [verbo cognitivo 2]... Este proceso le permite [verbo cognitivo 3]..., lo que finalmente lo lleva a concluir que la opción [letra de la respuesta correcta] es la correcta porque [justificación final].
+
+Análisis de Opciones No Válidas:
+- **Opción [Letra del distractor]:** El estudiante podría escoger esta opción si comete un error de [naturaleza de la confusión], lo que lo lleva a pensar que [razonamiento erróneo]. Sin embargo, esto es incorrecto porque [razón clara y concisa].
+- **Opción [Letra del distractor]:** La elección de esta alternativa sugiere una falla en [naturaleza de la confusión]. El estudiante posiblemente cree que [razonamiento erróneo], pero la opción es inválida debido a que [razón clara y concisa].
+- **Opción [Letra del distractor]:** Esta opción funciona como un distractor para quien [naturaleza de la confusión], interpretando erróneamente que [razonamiento erróneo]. Es incorrecta puesto que [razón clara y concisa].
+"""
+
+def construir_prompt_recomendaciones(fila):
+    fila = fila.fillna('')
+    return f"""
+🎯 ROL DEL SISTEMA
+Eres un experto en evaluación educativa con un profundo conocimiento de la pedagogía urbana. Tu misión es generar dos recomendaciones pedagógicas personalizadas a partir de cada ítem de evaluación formativa: una para Fortalecer y otra para Avanzar en el aprendizaje. Deberás identificar de manera endógena los verbos clave de los procesos cognitivos implicados, basándote en la competencia, el aprendizaje priorizado, la evidencia de aprendizaje, la tipología textual (cuando aplique), el grado escolar y el nivel educativo general de los estudiantes. Luego, integrarás estos verbos de forma fluida en la redacción de las recomendaciones. Considerarás las características cognitivas y pedagógicas del ítem y el texto (cuando aplique), así como las particularidades de los estudiantes.
+
+🧠 INSUMOS DE ENTRADA
+- Texto/Fragmento: {fila.get('ItemContexto', 'No aplica')}
+- Descripción del Ítem: {fila.get('ItemEnunciado', 'No aplica')}
+- Componente: {fila.get('ComponenteNombre', 'No aplica')}
+- Competencia: {fila.get('CompetenciaNombre', '')}
+- Aprendizaje Priorizado: {fila.get('AfirmacionNombre', '')}
+- Evidencia de Aprendizaje: {fila.get('EvidenciaNombre', '')}
+- Tipología Textual (Solo para Lectura Crítica): {fila.get('Tipologia Textual', 'No aplica')}
+- Grado Escolar: {fila.get('ItemGradoId', '')}
+- Análisis de Errores Comunes: {fila.get('Analisis_Errores', 'No aplica')}
+- Respuesta correcta: {fila.get('AlternativaClave', 'No aplica')}
+- Opción A: {fila.get('OpcionA', 'No aplica')}
+- Opción B: {fila.get('OpcionB', 'No aplica')}
+- Opción C: {fila.get('OpcionC', 'No aplica')}
+- Opción D: {fila.get('OpcionD', 'No aplica')}
+
+{INSTRUCCIONES_RECOMENDACIONES}✍️ FORMATO DE SALIDA DE LAS RECOMENDACIONES
+**IMPORTANTE: Responde de forma directa, usando obligatoriamente la siguiente estructura. No añadas texto adicional.**
+- **Redacción Impersonal:** Utiliza siempre una redacción profesional e impersonal (ej. "se sugiere (sin mencionar el docente)", "la tarea consiste en", "se entregan tarjetas").
+- **Sin Conclusiones:** Termina directamente con la lista de preguntas.
+
+RECOMENDACIÓN PARA FORTALECER EL APRENDIZAJE EVALUADO EN EL ÍTEM
+Para fortalecer la habilidad de [verbo clave extraído de la Evidencia de Aprendizaje], se sugiere al docente [descripción de la estrategia de andamiaje para ese proceso exacto].
+Una actividad que se puede hacer es: [Descripción detallada de la actividad novedosa y creativa, que no implica escritura].
+Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
+- [Pregunta 1: Que guíe el primer paso del proceso cognitivo]
+- [Pregunta 2: Que ayude a analizar un componente clave del proceso]
+- [Pregunta 3: Que conduzca a la conclusión del proceso base]
+
+RECOMENDACIÓN PARA AVANZAR EN EL APRENDIZAJE EVALUADO EN EL ÍTEM
+Para avanzar desde [proceso cognitivo de Fortalecer] hacia la habilidad de [verbo clave del proceso cognitivo superior], se sugiere al docente [descripción de la estrategia de complejización].
+Una actividad que se puede hacer es: [Descripción detallada de la actividad estimulante y poco convencional, que no implique escritura].
+Las preguntas orientadoras para esta actividad, entre otras, pueden ser:
+- [Pregunta 1: De análisis o evaluación que requiera un razonamiento más profundo]
+- [Pregunta 2: De aplicación, comparación o transferencia a un nuevo contexto]
+- [Pregunta 3: De metacognición o pensamiento crítico sobre el proceso completo]
+"""
+
+
+# Separación robusta de la respuesta de análisis en sus tres secciones
+def separar_analisis(texto_completo):
+    header_que_evalua = "Qué Evalúa:"
+    header_correcta = "Ruta Cognitiva Correcta:"
+    header_distractores = "Análisis de Opciones No Válidas:"
+    idx_correcta = texto_completo.find(header_correcta)
+    idx_distractores = texto_completo.find(header_distractores)
+    que_evalua = texto_completo[len(header_que_evalua):idx_correcta].strip() if idx_correcta != -1 else texto_completo
+    just_correcta = texto_completo[idx_correcta:idx_distractores].strip() if idx_correcta != -1 and idx_distractores != -1 else (texto_completo[idx_correcta:].strip() if idx_correcta != -1 else "ERROR")
+    an_distractores = texto_completo[idx_distractores:].strip() if idx_distractores != -1 else "ERROR"
+    return que_evalua, just_correcta, an_distractores
+
+# Separación robusta de la respuesta de recomendaciones en Fortalecer/Avanzar
+def separar_recomendaciones(texto_completo):
+    titulo_avanzar = "RECOMENDACIÓN PARA AVANZAR"
+    idx_avanzar = texto_completo.upper().find(titulo_avanzar)
+    if idx_avanzar != -1:
+        return texto_completo[:idx_avanzar].strip(), texto_completo[idx_avanzar:].strip()
+    return texto_completo, "ERROR: No se encontró 'AVANZAR'"
+
+# --- MODO POR LOTES: VARIOS ÍTEMS POR SOLICITUD CON SALIDA JSON ---
+# Un solo prompt con el preámbulo compartido y K ítems; el modelo responde un
+# arreglo JSON con un objeto por ítem que reúne análisis y recomendaciones.
+
+ESQUEMA_LOTE = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            campo: {"type": "STRING"}
+            for campo in ("id", "que_evalua", "ruta_correcta", "distractores", "fortalecer", "avanzar")
+        },
+        "required": ["id", "que_evalua", "ruta_correcta", "distractores", "fortalecer", "avanzar"],
+    },
+}
+
+PREAMBULO_LOTE = f"""
+🎯 ROL DEL SISTEMA
+Eres un experto en evaluación educativa con un profundo conocimiento de la pedagogía urbana, especializado en lectura y procesos cognitivos en el contexto de Bogotá. Recibirás varios ítems de evaluación formativa. Para cada ítem debes producir un análisis tripartito (qué evalúa, ruta cognitiva correcta y análisis de las opciones no válidas) y, a partir de ese análisis de errores, dos recomendaciones pedagógicas personalizadas: una para Fortalecer y otra para Avanzar en el aprendizaje. Identifica de manera endógena los verbos clave de los procesos cognitivos implicados según la competencia, el aprendizaje priorizado, la evidencia de aprendizaje, la tipología textual (cuando aplique) y el grado escolar, e intégralos de forma fluida en la redacción.
+
+{INSTRUCCIONES_ANALISIS}{INSTRUCCIONES_RECOMENDACIONES}✍️ FORMATO DE SALIDA
+Responde únicamente con un arreglo JSON que tenga exactamente un objeto por cada ítem recibido, con estos campos de texto:
+- "id": el ID del ítem, copiado tal cual.
+- "que_evalua": una frase que comience con "Este ítem evalúa la capacidad del estudiante para...".
+- "ruta_correcta": el párrafo de la ruta cognitiva, terminando con la justificación de la opción correcta.
+- "distractores": una línea por cada opción incorrecta, con el formato "- **Opción [Letra]:** [análisis del error]".
+- "fortalecer": la recomendación para fortalecer, con la estrategia sugerida (redacción impersonal), "Una actividad que se puede hacer es: ..." y tres preguntas orientadoras en líneas que empiecen con "- ".
+- "avanzar": la recomendación para avanzar, con la misma estructura y un salto cualitativo respecto a fortalecer.
+No incluyas títulos de sección dentro de los campos ni texto fuera del JSON.
+Cuando varios ítems comparten un mismo texto, este aparece una sola vez como TEXTO COMPARTIDO y esos ítems remiten a él.
+"""
+
+# Descripción de un ítem dentro del prompt por lotes (sin su ID); `contexto`
+# reemplaza el texto del ítem, por ejemplo por una remisión al texto compartido
+def describir_item_lote(fila, contexto=None):
+    fila = fila.fillna('')
+    return (
+        f"- Texto/Fragmento: {fila.get('ItemContexto', 'No aplica') if contexto is None else contexto}\n"
+        f"- Descripción del Ítem: {fila.get('ItemEnunciado', 'No aplica')}\n"
+        f"- Enunciado: {fila.get('Enunciado', '')}\n"
+        f"- Componente: {fila.get('ComponenteNombre', 'No aplica')}\n"
+        f"- Competencia: {fila.get('CompetenciaNombre', '')}\n"
+        f"- Aprendizaje Priorizado: {fila.get('AfirmacionNombre', '')}\n"
+        f"- Evidencia de Aprendizaje: {fila.get('EvidenciaNombre', '')}\n"
+        f"- Tipología Textual (Solo para Lectura Crítica): {fila.get('Tipologia Textual', 'No aplica')}\n"
+        f"- Grado Escolar: {fila.get('ItemGradoId', '')}\n"
+        f"- Respuesta correcta: {fila.get('AlternativaClave', 'No aplica')}\n"
+        f"- Opción A: {fila.get('OpcionA', 'No aplica')}\n"
+        f"- Opción B: {fila.get('OpcionB', 'No aplica')}\n"
+        f"- Opción C: {fila.get('OpcionC', 'No aplica')}\n"
+        f"- Opción D: {fila.get('OpcionD', 'No aplica')}\n"
+    )
+
+# Prompt de un lote [(id, fila), ...]: el preámbulo va una sola vez, y cada
+# texto (ItemContexto) que comparten dos o más ítems también
+def construir_prompt_lote(items):
+    conteo = {}
+    for _, fila in items:
+        texto = normalizar(fila.get('ItemContexto'))
+        if texto:
+            conteo[texto] = conteo.get(texto, 0) + 1
+    compartidos = {}
+    bloques = []
+    for _, fila in items:
+        texto = normalizar(fila.get('ItemContexto'))
+        if conteo.get(texto, 0) > 1 and texto not in compartidos:
+            compartidos[texto] = f"T{len(compartidos) + 1}"
+            bloques.append(f"### TEXTO COMPARTIDO {compartidos[texto]}\n{fila.get('ItemContexto')}\n")
+    for id_item, fila in items:
+        texto = normalizar(fila.get('ItemContexto'))
+        contexto = f"ver TEXTO COMPARTIDO {compartidos[texto]}" if texto in compartidos else None
+        bloques.append(f"### ÍTEM\nID del ítem: {id_item}\n{describir_item_lote(fila, contexto)}")
+    return PREAMBULO_LOTE + "\n🧠 ÍTEMS A PROCESAR\n\n" + "\n".join(bloques)
+
+# Valida la respuesta JSON de un lote. Devuelve {id: valores} solo con los
+# ítems esperados que traen los cinco campos con texto; los que falten o
+# vengan mal formados quedan fuera para reintentarlos. Los valores se
+# devuelven con los mismos títulos que produce el modo por ítem.
+def separar_lote(texto_completo, ids_esperados):
+    texto = texto_completo.strip()
+    if texto.startswith("```"):
+        texto = texto.strip("`").removeprefix("json").strip()
+    try:
+        objetos = json.loads(texto)
+    except ValueError:
+        return {}
+    if isinstance(objetos, dict):
+        objetos = objetos.get("items", [dict(valor, id=clave) for clave, valor in objetos.items() if isinstance(valor, dict)])
+    if not isinstance(objetos, list):
+        return {}
+    esperados = set(ids_esperados)
+    campos = ESQUEMA_LOTE["items"]["required"][1:]
+    validos = {}
+    for objeto in objetos:
+        if not isinstance(objeto, dict) or str(objeto.get("id", "")).strip() not in esperados:
+            continue
+        valores = [objeto.get(campo) for campo in campos]
+        if not all(isinstance(valor, str) and valor.strip() for valor in valores):
+            continue
+        que_evalua, ruta, distractores, fortalecer, avanzar = (valor.strip() for valor in valores)
+        validos[str(objeto["id"]).strip()] = (
+            que_evalua,
+            f"Ruta Cognitiva Correcta:\n{ruta}",
+            f"Análisis de Opciones No Válidas:\n{distractores}",
+            f"RECOMENDACIÓN PARA FORTALECER EL APRENDIZAJE EVALUADO EN EL ÍTEM\n{fortalecer}",
+            f"RECOMENDACIÓN PARA AVANZAR EN EL APRENDIZAJE EVALUADO EN EL ÍTEM\n{avanzar}",
+        )
+    return validos
+
+# Columnas que agrega cada etapa del enriquecimiento
+COLUMNAS_ANALISIS = ["Que_Evalua", "Justificacion_Correcta", "Analisis_Distractores"]
+COLUMNAS_RECOMENDACIONES = ["Recomendacion_Fortalecer", "Recomendacion_Avanzar"]
+
+# Copia de la fila con el resultado de su análisis; el prompt de recomendaciones
+# lee 'Analisis_Errores', que es el análisis de distractores recién generado
+def fila_con_analisis(fila, resultado_analisis):
+    valores, error = resultado_analisis
+    fila = fila.copy()
+    for columna, valor in zip(COLUMNAS_ANALISIS, valores):
+        fila[columna] = valor
+    if error is None and valores[2] != "ERROR":
+        fila["Analisis_Errores"] = valores[2]
+    return fila
+
+# Configuración efectiva de una solicitud (forma parte de la clave de caché)
+def config_generacion(backend, esquema=None):
+    if esquema is None:
+        return backend.generation_config
+    return dict(backend.generation_config, response_mime_type="application/json", response_schema=esquema)
+
+# Genera el texto de un prompt con el backend, consultando primero la caché persistente.
+# Con `leer_cache=False` se omite la consulta pero la respuesta nueva se guarda.
+# Con `trazador`, cada solicitud queda registrada con su latencia, reintentos y tokens.
+# Con `esquema`, se pide al backend una respuesta JSON que siga ese esquema.
+# Con `validar(texto)`, la respuesta solo se guarda en la caché si es válida,
+# para que un reproceso no vuelva a leer una respuesta que no se pudo separar.
+def generar_texto(backend, prompt, limitador=None, cache=None, leer_cache=True,
+                  trazador=None, etapa=None, posicion=None, esquema=None, validar=None):
+    clave = clave_cache(prompt, backend.modelo_nombre, config_generacion(backend, esquema)) if cache is not None else None
+    if clave is not None and leer_cache:
+        texto = cache.obtener(clave)
+        if texto is not None:
+            if trazador is not None:
+                trazador.registrar("solicitud", etapa=etapa, posicion=posicion, duracion=0.0, cache="acierto")
+            return texto
+    reintentos = []
+    inicio = time.perf_counter()
+    try:
+        generar = backend.generar if esquema is None else partial(backend.generar, esquema=esquema)
+        response = llamar_con_reintentos(generar, prompt, limitador,
+                                         al_reintentar=lambda intento, error: reintentos.append(error))
+    except Exception as e:
+        if trazador is not None:
+            trazador.registrar("solicitud", etapa=etapa, posicion=posicion, duracion=time.perf_counter() - inicio,
+                               reintentos=len(reintentos), error=str(e), cache="fallo" if clave else None)
+        raise
+    texto = response.text.strip()
+    if trazador is not None:
+        trazador.registrar("solicitud", etapa=etapa, posicion=posicion, duracion=time.perf_counter() - inicio,
+                           reintentos=len(reintentos), cache="fallo" if clave else None,
+                           tokens_entrada=getattr(response, "tokens_entrada", None),
+                           tokens_salida=getattr(response, "tokens_salida", None))
+    if clave is not None and (validar is None or validar(texto)):
+        cache.guardar(clave, texto)
+    return texto
+
+# Validador para generar_texto: la respuesta se separa sin secciones en ERROR
+def _se_puede_separar(separar):
+    return lambda texto: not any(str(valor).startswith("ERROR") for valor in separar(texto))
+
+# Registra las respuestas cuyas secciones no se pudieron separar
+def _registrar_fallo_parseo(trazador, etapa, posicion, valores):
+    if trazador is not None and any(str(valor).startswith("ERROR") for valor in valores):
+        trazador.registrar("fallo_parseo", etapa=etapa, posicion=posicion)
+
+# Análisis de una fila; devuelve (valores, error) para reportar desde el hilo principal
+def analizar_fila(backend, fila, limitador=None, cache=None, leer_cache=True, trazador=None, posicion=None):
+    prompt = construir_prompt_analisis(fila)
+    try:
+        valores = separar_analisis(generar_texto(backend, prompt, limitador, cache, leer_cache,
+                                                 trazador, "analisis", posicion,
+                                                 validar=_se_puede_separar(separar_analisis)))
+        _registrar_fallo_parseo(trazador, "analisis", posicion, valores)
+        return valores, None
+    except Exception as e:
+        return ("ERROR API", "ERROR API", "ERROR API"), e
+
+# Recomendaciones de una fila; devuelve (valores, error)
+def recomendar_fila(backend, fila, limitador=None, cache=None, leer_cache=True, trazador=None, posicion=None):
+    prompt = construir_prompt_recomendaciones(fila)
+    try:
+        valores = separar_recomendaciones(generar_texto(backend, prompt, limitador, cache, leer_cache,
+                                                        trazador, "recomendaciones", posicion,
+                                                        validar=_se_puede_separar(separar_recomendaciones)))
+        _registrar_fallo_parseo(trazador, "recomendaciones", posicion, valores)
+        return valores, None
+    except Exception as e:
+        return ("ERROR API", "ERROR API"), e
+
+# Análisis y recomendaciones de un lote [(posicion, fila), ...] con una sola
+# solicitud. Cada ítem se guarda en la caché por separado, así que un ítem ya
+# generado se reutiliza aunque cambie la composición del lote. Devuelve
+# {posicion: (valores, error)} con los cinco valores de ambas etapas.
+def procesar_lote(backend, items, limitador=None, cache=None, leer_cache=True, trazador=None):
+    resultados = {}
+    claves = {}
+    if cache is not None:
+        configuracion = config_generacion(backend, ESQUEMA_LOTE)
+        for posicion, fila in items:
+            claves[posicion] = clave_cache(PREAMBULO_LOTE + describir_item_lote(fila), backend.modelo_nombre, configuracion)
+            guardado = cache.obtener(claves[posicion]) if leer_cache else None
+            if guardado is not None:
+                resultados[posicion] = (tuple(json.loads(guardado)), None)
+                if trazador is not None:
+                    trazador.registrar("solicitud", etapa="lote", posicion=posicion, duracion=0.0, cache="acierto")
+    pendientes = [(posicion, fila) for posicion, fila in items if posicion not in resultados]
+    _solicitar_lote(backend, pendientes, resultados, claves, limitador, cache, trazador)
+    return resultados
+
+# Envía un lote y valida la respuesta; los ítems que falten o vengan mal
+# formados se reintentan partiendo el lote en dos hasta llegar a un solo ítem
+def _solicitar_lote(backend, items, resultados, claves, limitador, cache, trazador):
+    if not items:
+        return
+    prompt = construir_prompt_lote([(str(posicion), fila) for posicion, fila in items])
+    try:
+        texto = generar_texto(backend, prompt, limitador, trazador=trazador, etapa="lote", esquema=ESQUEMA_LOTE)
+    except Exception as e:
+        for posicion, _ in items:
+            resultados[posicion] = (("ERROR API",) * 5, e)
+        return
+    validos = separar_lote(texto, [str(posicion) for posicion, _ in items])
+    faltantes = []
+    for posicion, fila in items:
+        valores = validos.get(str(posicion))
+        if valores is None:
+            faltantes.append((posicion, fila))
+            continue
+        resultados[posicion] = (valores, None)
+        if cache is not None:
+            cache.guardar(claves[posicion], json.dumps(valores, ensure_ascii=False))
+    if not faltantes:
+        return
+    if trazador is not None:
+        trazador.registrar("fallo_parseo", etapa="lote", items=len(faltantes))
+    if len(items) == 1:
+        resultados[items[0][0]] = (("ERROR: respuesta JSON inválida",) * 5, None)
+        return
+    mitad = (len(faltantes) + 1) // 2
+    _solicitar_lote(backend, faltantes[:mitad], resultados, claves, limitador, cache, trazador)
+    _solicitar_lote(backend, faltantes[mitad:], resultados, claves, limitador, cache, trazador)
+
+# Vuelca en el DataFrame los resultados guardados de una corrida; las filas sin
+# resultado quedan vacías. Cada columna se arma como lista y se asigna una sola
+# vez: escribir celda por celda copia la columna entera en cada escritura
+# cuando es de texto de Arrow.
+def aplicar_resultados(df, resultados):
+    columnas = {columna: [""] * len(df) for columna in COLUMNAS_ANALISIS + COLUMNAS_RECOMENDACIONES}
+    for (posicion, etapa), (valores, _) in resultados.items():
+        nombres = COLUMNAS_ANALISIS if etapa == "analisis" else COLUMNAS_RECOMENDACIONES
+        for columna, valor in zip(nombres, valores):
+            columnas[columna][posicion] = valor
+    for columna, valores in columnas.items():
+        df[columna] = valores
+    return df
+
+# Reconstruye el DataFrame enriquecido de una corrida a partir de lo guardado
+def cargar_resultados_corrida(almacen, run_id):
+    return aplicar_resultados(almacen.cargar_datos(run_id), almacen.resultados(run_id))
+
+# Vista previa de una corrida en curso: las últimas `limite` filas terminadas,
+# con su número de fila y los resultados, sin cargar los datos de la corrida
+def vista_previa_corrida(almacen, run_id, limite=20):
+    import pandas as pd
+
+    resultados = almacen.ultimos_resultados(run_id, limite)
+    posiciones = sorted({posicion for posicion, _ in resultados}, reverse=True)
+    df = pd.DataFrame({"Fila": [posicion + 1 for posicion in posiciones]})
+    indices = {posicion: indice for indice, posicion in enumerate(posiciones)}
+    return aplicar_resultados(df, {(indices[posicion], etapa): resultado
+                                   for (posicion, etapa), resultado in resultados.items()})
+
+# Número de filas con alguna etapa terminada en ERROR
+def contar_fallidas(resultados):
+    return len({posicion for (posicion, _), resultado in resultados.items() if es_fallido(*resultado)})
+
+# --- ETAPAS DEL PIPELINE ---
+# Todas aceptan un `trazador` opcional (metricas.Trazador) que mide la etapa.
+
+def _medir(trazador, etapa, items=None):
+    return trazador.etapa(etapa, items) if trazador is not None else nullcontext()
+
+# Columnas del Excel que hacen falta para los prompts, la plantilla y el
+# nombre de las fichas; None (todas) si aún no hay plantilla. Cargar solo
+# estas columnas acelera la lectura, pero el Excel exportado ya no trae las
+# demás, así que quien llama debe pedirlo de forma explícita.
+def columnas_necesarias(plantilla_bytes=None, columna_nombre_archivo=None):
+    if not plantilla_bytes:
+        return None
+    columnas = COLUMNAS_PROMPT + sorted(variables_plantilla(plantilla_bytes))
+    if columna_nombre_archivo:
+        columnas.append(columna_nombre_archivo)
+    return columnas
+
+# Lee el Excel de datos base (ruta o archivo abierto) por bloques, conservando
+# solo `columnas` (todas si es None)
+def cargar_excel(origen, columnas=None, trazador=None):
+    with _medir(trazador, "carga"):
+        return leer_libro(origen, columnas)
+
+# Limpieza de HTML, entidades y espacios en las columnas que usan los prompts y
+# la plantilla (todas las de texto si aún no hay plantilla)
+def limpiar_datos(df, plantilla_bytes=None, trazador=None):
+    columnas = None
+    if plantilla_bytes:
+        columnas = COLUMNAS_PROMPT + sorted(variables_plantilla(plantilla_bytes))
+    with _medir(trazador, "limpieza", len(df)):
+        return limpiar_columnas(df, columnas)
+
+# Ejecuta (o reanuda) una corrida guardada en `almacen`. Cada etapa de cada fila
+# se guarda en cuanto termina; las etapas ya guardadas se reutilizan y, con
+# `reprocesar_fallidas`, solo se vuelven a enviar las que terminaron en ERROR.
+# `al_progresar(evento)` recibe, desde el hilo que llama, un diccionario con
+# "etapa" ("inicio", "analisis" o "recomendaciones"), "posicion", "valores",
+# "error", "completadas" y "total". Devuelve el DataFrame final.
+# Con `tamano_lote` > 1 se usa el modo por lotes: cada solicitud lleva hasta
+# ese número de filas y trae a la vez su análisis y sus recomendaciones.
+# Antes de enviar nada se planifica la corrida (planificacion.py): las filas
+# con entradas idénticas se resuelven una sola vez y el resultado se reparte;
+# el evento "inicio" trae el resumen del plan en "plan".
+def enriquecer_corrida(backend, almacen, run_id, reprocesar_fallidas=False, limitador=None,
+                       cache=None, leer_cache=True, max_concurrencia=None, al_progresar=None, trazador=None,
+                       tamano_lote=None, deduplicar=True):
+    tamano_lote = config.TAMANO_LOTE_PROMPTS if tamano_lote is None else tamano_lote
+    df = almacen.cargar_datos(run_id)
+    guardados = almacen.resultados(run_id)
+    reprocesadas = set()
+    if reprocesar_fallidas:
+        reprocesadas = {clave for clave, resultado in guardados.items() if es_fallido(*resultado)}
+        # Si el análisis de una fila falló, sus recomendaciones se generaron sin
+        # el análisis de distractores: se rehacen a partir del análisis nuevo
+        reprocesadas |= {(posicion, "recomendaciones") for posicion, etapa in reprocesadas
+                         if etapa == "analisis" and (posicion, "recomendaciones") in guardados}
+        guardados = {clave: resultado for clave, resultado in guardados.items() if clave not in reprocesadas}
+
+    # Las etapas que se reprocesan no leen la caché: su respuesta guardada
+    # podría ser la misma que no se pudo separar
+    def usar_cache(posicion, etapa):
+        return leer_cache and (posicion, etapa) not in reprocesadas
+
+    # Guarda el resultado de una fila también en sus duplicadas que no lo tengan
+    def repartir(posicion, etapa, resultado):
+        for duplicada in plan.duplicados.get(posicion, []):
+            if (duplicada, etapa) not in guardados:
+                almacen.guardar_etapa(run_id, duplicada, etapa, *resultado)
+
+    # Reutiliza lo guardado o ejecuta la etapa y la guarda de inmediato
+    def etapa_con_punto_control(etapa, posicion, ejecutar):
+        resultado = guardados.get((posicion, etapa))
+        if resultado is None:
+            inicio = time.perf_counter()
+            resultado = ejecutar()
+            almacen.guardar_etapa(run_id, posicion, etapa, *resultado)
+            if trazador is not None:
+                trazador.registrar("fila", etapa=etapa, posicion=posicion, duracion=time.perf_counter() - inicio,
+                                   error=None if resultado[1] is None else str(resultado[1]))
+        repartir(posicion, etapa, resultado)
+        return resultado
+
+    # Etapas por ítem: las recomendaciones de cada fila arrancan en cuanto
+    # termina su análisis, sin esperar al resto del archivo
+    etapas = [
+        lambda item, previos: etapa_con_punto_control(
+            "analisis", item[0],
+            lambda: analizar_fila(backend, item[1], limitador, cache, usar_cache(item[0], "analisis"),
+                                  trazador, item[0])),
+        lambda item, previos: etapa_con_punto_control(
+            "recomendaciones", item[0],
+            lambda: recomendar_fila(backend, fila_con_analisis(item[1], previos[0]), limitador, cache,
+                                    usar_cache(item[0], "recomendaciones"), trazador, item[0])),
+    ]
+    items = list(enumerate(fila for _, fila in df.iterrows()))
+    etapas_faltantes = {posicion: sum((posicion, etapa) not in guardados for etapa in ETAPAS) for posicion, _ in items}
+    pendientes = [item for item in items if etapas_faltantes[item[0]]]
+    plan = planificar(pendientes, COLUMNAS_PROMPT, tamano_lote, deduplicar, etapas_faltantes)
+    completadas = {etapa: 0 for etapa in ETAPAS}
+
+    def notificar(evento):
+        if al_progresar is not None:
+            al_progresar(dict(evento, total=len(pendientes)))
+
+    notificar({"etapa": "inicio", "posicion": None, "valores": None, "error": None,
+               "completadas": 0, "reutilizadas": len(items) - len(pendientes), "plan": plan.resumen()})
+
+    # El DataFrame se completa una sola vez al final; durante la corrida solo
+    # se notifica el avance
+    def registrar_etapa(posicion, etapa, valores, error):
+        completadas[etapa] += 1
+        notificar({"etapa": etapa, "posicion": posicion, "valores": valores, "error": error,
+                   "completadas": completadas[etapa]})
+
+    # Notifica una etapa terminada de una fila y de sus duplicadas
+    def registrar_con_duplicadas(posicion, etapa, resultado):
+        registrar_etapa(posicion, etapa, *resultado)
+        for duplicada in plan.duplicados.get(posicion, []):
+            registrar_etapa(duplicada, etapa, *guardados.get((duplicada, etapa), resultado))
+
+    def al_terminar_etapa(indice, numero_etapa, resultados_item):
+        etapa = ETAPAS[numero_etapa]
+        registrar_con_duplicadas(plan.representantes[indice][0], etapa, resultados_item[numero_etapa])
+
+    # Modo por lotes: una sola etapa por lote que guarda ambas etapas de cada fila
+    def etapa_lote(lote, previos):
+        inicio = time.perf_counter()
+        # En los lotes la caché solo guarda ítems ya validados, así que se lee siempre
+        nuevos = procesar_lote(backend, lote, limitador, cache, leer_cache, trazador)
+        duracion = time.perf_counter() - inicio
+        por_fila = []
+        for posicion, _ in lote:
+            valores, error = nuevos[posicion]
+            resultado_fila = {}
+            for etapa, valores_etapa in zip(ETAPAS, (valores[:3], valores[3:])):
+                resultado = guardados.get((posicion, etapa))
+                if resultado is None:
+                    resultado = (valores_etapa, error)
+                    almacen.guardar_etapa(run_id, posicion, etapa, *resultado)
+                    if trazador is not None:
+                        trazador.registrar("fila", etapa=etapa, posicion=posicion, duracion=duracion,
+                                           error=None if error is None else str(error))
+                repartir(posicion, etapa, resultado)
+                resultado_fila[etapa] = resultado
+            por_fila.append((posicion, resultado_fila))
+        return por_fila
+
+    def al_terminar_lote(indice, numero_etapa, resultados_lote):
+        for posicion, resultado_fila in resultados_lote[0]:
+            for etapa in ETAPAS:
+                registrar_con_duplicadas(posicion, etapa, resultado_fila[etapa])
+
+    with _medir(trazador, "enriquecimiento", len(pendientes)):
+        if tamano_lote > 1:
+            ejecutar_pipeline(plan.lotes, [etapa_lote], max_concurrencia=max_concurrencia, al_progresar=al_terminar_lote)
+        else:
+            ejecutar_pipeline(plan.representantes, etapas, max_concurrencia=max_concurrencia,
+                              al_progresar=al_terminar_etapa)
+    return aplicar_resultados(df, almacen.resultados(run_id))
+
+# Escribe el Excel enriquecido en `destino` (ruta o archivo abierto)
+def exportar_excel(df, destino, trazador=None):
+    with _medir(trazador, "exportacion", len(df)):
+        escribir_libro(df, destino, nombre_hoja='Datos Enriquecidos')
+
+# Ensambla una ficha por fila y las escribe en el .zip `ruta_zip`.
+# `al_progresar(completadas, total)` se invoca tras cada ficha escrita. Con
+# `perfilador` ("cprofile" o "pyinstrument") y un trazador, el informe del
+# perfil queda en `trazador.perfil`; con varios procesos solo se perfila el
+# proceso principal, así que para perfilar el renderizado conviene un proceso.
+def ensamblar_zip(df, plantilla_bytes, columna_nombre_archivo, ruta_zip, max_procesos=None,
+                  nivel_compresion=None, al_progresar=None, trazador=None, perfilador=None):
+    if columna_nombre_archivo not in df.columns:
+        raise ValueError(f"La columna '{columna_nombre_archivo}' no existe en el Excel. Por favor, elige una de: {', '.join(df.columns)}")
+    filas = (
+        (nombre_archivo_ficha(fila[columna_nombre_archivo]), fila.to_dict())
+        for _, fila in df.iterrows()
+    )
+    fichas = renderizar_fichas(plantilla_bytes, filas, max_procesos=max_procesos)
+    with _medir(trazador, "ensamblaje", len(df)), perfilar(perfilador, trazador):
+        for completadas in escribir_zip(ruta_zip, fichas, nivel_compresion):
+            if al_progresar is not None:
+                al_progresar(completadas, len(df))
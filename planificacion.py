@@ -0,0 +1,80 @@
+import hashlib
+import math
+import re
+
+# --- PLANIFICACIÓN DE LAS SOLICITUDES ANTES DEL ENRIQUECIMIENTO ---
+# Cada fila recibe una huella de sus entradas de prompt normalizadas; las filas
+# con la misma huella se resuelven con una sola solicitud y el resultado se
+# reparte a todas. En el modo por lotes, además, los ítems que comparten texto
+# (ItemContexto) se agrupan para que el texto viaje una sola vez por lote.
+
+PATRON_ESPACIOS = re.compile(r"\s+")
+
+# Texto comparable de una celda: sin vacíos/NaN y con los espacios colapsados
+def normalizar(valor):
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return ""
+    return PATRON_ESPACIOS.sub(" ", str(valor)).strip()
+
+def huella_entradas(fila, columnas):
+    contenido = "\x1f".join(f"{columna}={normalizar(fila.get(columna))}" for columna in columnas)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class Plan:
+    def __init__(self, total_filas, representantes, duplicados, grupos, tamano_lote, etapas_faltantes=None):
+        self.total_filas = total_filas
+        self.representantes = representantes
+        self.duplicados = duplicados
+        self.grupos = grupos
+        self.tamano_lote = tamano_lote
+        self.etapas_faltantes = etapas_faltantes or {}
+        items = [item for grupo in grupos for item in grupo]
+        self.lotes = [items[inicio:inicio + tamano_lote] for inicio in range(0, len(items), tamano_lote)]
+
+    # Solicitudes y textos enviados con y sin plan
+    def resumen(self):
+        unicas = len(self.representantes)
+        if self.tamano_lote > 1:
+            solicitudes = len(self.lotes)
+            solicitudes_sin_plan = math.ceil(self.total_filas / self.tamano_lote)
+            textos = sum(len({normalizar(fila.get("ItemContexto")) for _, fila in lote} - {""}) for lote in self.lotes)
+        else:
+            # Una solicitud por cada etapa que le falte a la fila (dos si no tiene ninguna guardada)
+            faltantes = self.etapas_faltantes
+            solicitudes = sum(faltantes.get(posicion, 2) for posicion, _ in self.representantes)
+            solicitudes_sin_plan = solicitudes + sum(
+                faltantes.get(duplicada, 2) for duplicadas in self.duplicados.values() for duplicada in duplicadas
+            )
+            textos = len([fila for _, fila in self.representantes if normalizar(fila.get("ItemContexto"))])
+        return {
+            "filas": self.total_filas,
+            "unicas": unicas,
+            "duplicadas": self.total_filas - unicas,
+            "textos_compartidos": len([grupo for grupo in self.grupos if len(grupo) > 1
+                                       and normalizar(grupo[0][1].get("ItemContexto"))]),
+            "solicitudes": solicitudes,
+            "solicitudes_sin_plan": solicitudes_sin_plan,
+            "textos_enviados": textos,
+        }
+
+
+# Planifica los ítems [(posicion, fila), ...]. `columnas` son las entradas de
+# los prompts que definen la huella; con `deduplicar=False` cada fila es única.
+# `etapas_faltantes` ({posicion: cantidad}) indica cuántas etapas le faltan a
+# cada fila de una corrida reanudada; sin él se cuentan las dos.
+def planificar(items, columnas, tamano_lote=1, deduplicar=True, etapas_faltantes=None):
+    representantes = []
+    duplicados = {}
+    por_huella = {}
+    for posicion, fila in items:
+        huella = huella_entradas(fila, columnas) if deduplicar else posicion
+        if huella in por_huella:
+            duplicados.setdefault(por_huella[huella], []).append(posicion)
+        else:
+            por_huella[huella] = posicion
+            representantes.append((posicion, fila))
+    grupos = {}
+    for posicion, fila in representantes:
+        grupos.setdefault(normalizar(fila.get("ItemContexto")), []).append((posicion, fila))
+    return Plan(len(items), representantes, duplicados, list(grupos.values()), tamano_lote, etapas_faltantes)
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+import config
+
+# --- ARCHIVOS TEMPORALES POR SESIÓN ---
+# Los resultados grandes se escriben en disco en lugar de guardarse en memoria.
+# Cada archivo se elimina cuando su objeto deja de existir (por ejemplo, al
+# cerrarse la sesión de Streamlit que lo guardaba), al terminar el proceso, o
+# en la limpieza periódica de archivos antiguos si el proceso se cayó. La
+# limpieza no toca los archivos que aún tiene algún ArchivoTemporal vivo.
+
+# Rutas de los ArchivoTemporal vivos de este proceso
+_rutas_vivas = set()
+_lock_rutas = threading.Lock()
+
+
+def _eliminar(ruta):
+    with _lock_rutas:
+        _rutas_vivas.discard(ruta)
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+class ArchivoTemporal:
+    def __init__(self, sufijo="", directorio=None):
+        directorio = directorio or config.DIRECTORIO_TEMPORAL
+        os.makedirs(directorio, exist_ok=True)
+        descriptor, self.ruta = tempfile.mkstemp(suffix=sufijo, dir=directorio)
+        os.close(descriptor)
+        self.ruta = os.path.abspath(self.ruta)
+        with _lock_rutas:
+            _rutas_vivas.add(self.ruta)
+        self._finalizador = weakref.finalize(self, _eliminar, self.ruta)
+
+    # False si el archivo desapareció del disco (por ejemplo, lo borró otro proceso)
+    def existe(self):
+        return os.path.isfile(self.ruta)
+
+    def tamano(self):
+        return os.path.getsize(self.ruta)
+
+    # Archivo abierto para lectura binaria; quien lo recibe se encarga de cerrarlo
+    def abrir(self):
+        return open(self.ruta, "rb")
+
+    def eliminar(self):
+        self._finalizador()
+
+
+# Elimina archivos temporales más antiguos que `max_horas` (restos de procesos
+# caídos), salvo los que siguen en uso en este proceso
+def limpiar_antiguos(max_horas=None, directorio=None):
+    max_horas = config.TEMPORALES_MAX_HORAS if max_horas is None else max_horas
+    directorio = directorio or config.DIRECTORIO_TEMPORAL
+    if not os.path.isdir(directorio):
+        return 0
+    limite = time.time() - max_horas * 3600
+    eliminados = 0
+    with _lock_rutas:
+        en_uso = set(_rutas_vivas)
+    for nombre in os.listdir(directorio):
+        ruta = os.path.abspath(os.path.join(directorio, nombre))
+        if ruta in en_uso:
+            continue
+        try:
+            if os.path.isfile(ruta) and os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+                eliminados += 1
+        except OSError:
+            continue
+    return eliminados
@@ -0,0 +1,349 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+import config
+import pipeline
+from corridas import huella_clave
+from metricas import Trazador
+from motor import LimitadorTasa
+
+# --- TRABAJOS DE ENRIQUECIMIENTO EN SEGUNDO PLANO ---
+# Las corridas se encolan en una cola persistente (SQLite) y las ejecuta un
+# grupo de hilos trabajadores, fuera de la ejecución del script de Streamlit:
+# una recarga o un clic en otro widget ya no interrumpe el enriquecimiento.
+# Todas las sesiones comparten un mismo LimitadorTasa (presupuesto global de
+# RPM/TPM) que concede su cupo por turnos entre las claves API, y los trabajos
+# pendientes también se reparten por turnos entre claves: un usuario con
+# muchas corridas o mucha concurrencia no acapara trabajadores ni presupuesto.
+# Las claves API solo se guardan en memoria; en la cola queda su huella. Si el
+# proceso se reinicia, los trabajos de una clave esperan a que vuelva a
+# ingresarse.
+# Cada trabajo en curso guarda la máquina y el pid de su dueño y un latido que
+# el dueño renueva. Solo vuelven a la cola los trabajos cuyo dueño murió o
+# dejó de latir; otro gestor del mismo proceso (por ejemplo, tras vaciar la
+# caché de recursos de Streamlit) no le quita los trabajos al anterior.
+
+ESTADOS_ACTIVOS = ("pendiente", "en_curso")
+
+# Trazadores de trabajos terminados que se conservan en memoria para mostrar
+# sus métricas tras recargar la página
+MAX_TRAZADORES_TERMINADOS = 20
+
+# Si el proceso `pid` de esta máquina sigue vivo. En Windows os.kill termina
+# el proceso, así que allí solo se usa el latido.
+def _proceso_vivo(pid):
+    if os.name == "nt" or pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TrabajoCancelado(Exception):
+    pass
+
+
+class GestorTrabajos:
+    # `crear_backend(api_key)` construye el backend de cada trabajo (por
+    # defecto Gemini); `limitador` es el presupuesto compartido por todos.
+    def __init__(self, almacen, cache=None, ruta=None, max_trabajos=None, limitador=None,
+                 crear_backend=None, intervalo_progreso=None, latido=None, vencimiento=None):
+        self.almacen = almacen
+        self.cache = cache
+        self.ruta = ruta or config.RUTA_TRABAJOS
+        self.limitador = limitador or LimitadorTasa()
+        self.crear_backend = crear_backend or pipeline.setup_model
+        self.intervalo_progreso = config.INTERVALO_PROGRESO_S if intervalo_progreso is None else intervalo_progreso
+        self.latido = latido or config.LATIDO_TRABAJOS_S
+        self.vencimiento = vencimiento or config.VENCIMIENTO_TRABAJOS_S
+        self._host = socket.gethostname()
+        self._pid = os.getpid()
+        self._claves = {}
+        self._cancelados = set()
+        self._en_curso = set()
+        self._trazadores = {}
+        self._trazadores_terminados = deque()
+        self._ultima_clave = None
+        self._detenido = False
+        self._lock = threading.Lock()
+        self._condicion = threading.Condition()
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+        with self._lock:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(
+                "CREATE TABLE IF NOT EXISTS trabajos ("
+                " trabajo_id TEXT PRIMARY KEY, run_id TEXT NOT NULL, clave TEXT NOT NULL,"
+                " estado TEXT NOT NULL, opciones TEXT NOT NULL, creado REAL NOT NULL,"
+                " iniciado REAL, terminado REAL, total INTEGER, analisis INTEGER NOT NULL DEFAULT 0,"
+                " recomendaciones INTEGER NOT NULL DEFAULT 0, fallidas INTEGER, plan TEXT, error TEXT,"
+                " host TEXT, pid INTEGER, latido REAL)"
+            )
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_estado ON trabajos (estado, creado)")
+            self._conexion.commit()
+        self._recuperar_huerfanos()
+        self._hilos = [
+            threading.Thread(target=self._trabajar, name=f"trabajador-{numero}", daemon=True)
+            for numero in range(max_trabajos or config.MAX_TRABAJOS_SIMULTANEOS)
+        ]
+        self._hilos.append(threading.Thread(target=self._latir, name="latido-trabajos", daemon=True))
+        for hilo in self._hilos:
+            hilo.start()
+
+    # Deja disponible una clave API para sus trabajos y devuelve su huella
+    def registrar_clave(self, api_key):
+        clave = huella_clave(api_key)
+        with self._condicion:
+            self._claves[clave] = api_key
+            self._condicion.notify_all()
+        return clave
+
+    # Trabajo pendiente o en curso de una corrida (None si no hay ninguno)
+    def trabajo_activo(self, run_id):
+        with self._lock:
+            return self._buscar_activo(run_id)
+
+    # (el _lock debe estar tomado)
+    def _buscar_activo(self, run_id):
+        fila = self._conexion.execute(
+            "SELECT trabajo_id FROM trabajos WHERE run_id = ? AND estado IN (?, ?) LIMIT 1", (run_id, *ESTADOS_ACTIVOS)
+        ).fetchone()
+        return fila[0] if fila else None
+
+    # Encola el enriquecimiento de una corrida ya creada en el almacén; con
+    # `trazador`, las métricas del trabajo se suman a las de ese trazador.
+    # Una corrida tiene como máximo un trabajo activo: si ya hay uno, se
+    # devuelve ese en lugar de encolar otro que escribiría las mismas filas.
+    def enviar(self, run_id, api_key, reprocesar_fallidas=False, leer_cache=True,
+               max_concurrencia=None, tamano_lote=None, trazador=None):
+        clave = self.registrar_clave(api_key)
+        trabajo_id = uuid.uuid4().hex[:12]
+        opciones = {"reprocesar_fallidas": reprocesar_fallidas, "leer_cache": leer_cache,
+                    "max_concurrencia": max_concurrencia, "tamano_lote": tamano_lote}
+        with self._lock:
+            activo = self._buscar_activo(run_id)
+            if activo is not None:
+                return activo
+            if trazador is not None:
+                self._trazadores[trabajo_id] = trazador
+            self._conexion.execute(
+                "INSERT INTO trabajos (trabajo_id, run_id, clave, estado, opciones, creado)"
+                " VALUES (?, ?, ?, 'pendiente', ?, ?)",
+                (trabajo_id, run_id, clave, json.dumps(opciones), time.time())
+            )
+            self._conexion.commit()
+        with self._condicion:
+            self._condicion.notify_all()
+        return trabajo_id
+
+    # Un trabajo pendiente se descarta; uno en curso se detiene en la siguiente
+    # etapa terminada (lo ya guardado se conserva y la corrida puede reanudarse)
+    def cancelar(self, trabajo_id):
+        with self._lock:
+            cursor = self._conexion.execute(
+                "UPDATE trabajos SET estado = 'cancelado', terminado = ? WHERE trabajo_id = ? AND estado = 'pendiente'",
+                (time.time(), trabajo_id)
+            )
+            self._conexion.commit()
+            if cursor.rowcount == 0:
+                self._cancelados.add(trabajo_id)
+            else:
+                self._olvidar_trazador(trabajo_id)
+
+    # Conserva el trazador de un trabajo terminado y descarta los más antiguos
+    # (el _lock debe estar tomado)
+    def _olvidar_trazador(self, trabajo_id):
+        if trabajo_id not in self._trazadores:
+            return
+        self._trazadores_terminados.append(trabajo_id)
+        while len(self._trazadores_terminados) > MAX_TRAZADORES_TERMINADOS:
+            self._trazadores.pop(self._trazadores_terminados.popleft(), None)
+
+    def _como_dict(self, cursor, fila):
+        trabajo = dict(zip([columna[0] for columna in cursor.description], fila))
+        trabajo["opciones"] = json.loads(trabajo["opciones"])
+        trabajo["plan"] = json.loads(trabajo["plan"]) if trabajo["plan"] else None
+        return trabajo
+
+    def estado(self, trabajo_id):
+        with self._lock:
+            cursor = self._conexion.execute("SELECT * FROM trabajos WHERE trabajo_id = ?", (trabajo_id,))
+            fila = cursor.fetchone()
+            if fila is None:
+                return None
+            trabajo = self._como_dict(cursor, fila)
+            if trabajo["estado"] == "pendiente":
+                trabajo["posicion_cola"] = self._conexion.execute(
+                    "SELECT COUNT(*) FROM trabajos WHERE estado = 'pendiente' AND creado < ?", (trabajo["creado"],)
+                ).fetchone()[0] + 1
+        trabajo["clave_disponible"] = trabajo["clave"] in self._claves
+        return trabajo
+
+    # Cantidad de trabajos por estado, para mostrar la ocupación de la cola
+    def resumen(self):
+        with self._lock:
+            return dict(self._conexion.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado").fetchall())
+
+    def listar(self, limite=20):
+        with self._lock:
+            cursor = self._conexion.execute("SELECT * FROM trabajos ORDER BY creado DESC LIMIT ?", (limite,))
+            return [self._como_dict(cursor, fila) for fila in cursor.fetchall()]
+
+    # Trazador en memoria del trabajo (None si se ejecutó en otro proceso)
+    def trazador(self, trabajo_id):
+        return self._trazadores.get(trabajo_id)
+
+    def detener(self):
+        with self._condicion:
+            self._detenido = True
+            self._condicion.notify_all()
+        for hilo in self._hilos:
+            hilo.join()
+
+    # Devuelve a la cola los trabajos en curso cuyo dueño ya no existe: su
+    # proceso terminó o dejó de renovar el latido (colgado o en otra máquina).
+    # Los puntos de control de la corrida evitan repetir lo ya hecho.
+    def _recuperar_huerfanos(self):
+        ahora = time.time()
+        with self._lock:
+            en_curso = self._conexion.execute(
+                "SELECT trabajo_id, host, pid, latido FROM trabajos WHERE estado = 'en_curso'"
+            ).fetchall()
+            huerfanos = [
+                (trabajo_id,) for trabajo_id, host, pid, latido in en_curso
+                if trabajo_id not in self._en_curso
+                and (latido is None or ahora - latido > self.vencimiento
+                     or (host == self._host and not _proceso_vivo(pid)))
+            ]
+            if huerfanos:
+                self._conexion.executemany(
+                    "UPDATE trabajos SET estado = 'pendiente', host = NULL, pid = NULL, latido = NULL"
+                    " WHERE trabajo_id = ? AND estado = 'en_curso'", huerfanos
+                )
+                self._conexion.commit()
+        if huerfanos:
+            with self._condicion:
+                self._condicion.notify_all()
+
+    # Renueva el latido de los trabajos de este gestor y recupera los huérfanos
+    def _latir(self):
+        while True:
+            with self._condicion:
+                self._condicion.wait(timeout=self.latido)
+                if self._detenido:
+                    return
+            with self._lock:
+                self._conexion.executemany(
+                    "UPDATE trabajos SET latido = ? WHERE trabajo_id = ? AND host = ? AND pid = ?",
+                    [(time.time(), trabajo_id, self._host, self._pid) for trabajo_id in list(self._en_curso)]
+                )
+                self._conexion.commit()
+            self._recuperar_huerfanos()
+
+    # Toma el siguiente trabajo por turnos entre las claves con trabajos
+    # pendientes (y disponibles en memoria) y lo marca como en curso a nombre
+    # de este proceso. Si otro gestor lo tomó antes, se pasa al siguiente.
+    def _tomar_siguiente(self):
+        with self._lock:
+            while True:
+                pendientes = self._conexion.execute(
+                    "SELECT trabajo_id, clave FROM trabajos WHERE estado = 'pendiente' ORDER BY creado"
+                ).fetchall()
+                primero_por_clave = {}
+                for trabajo_id, clave in pendientes:
+                    if clave in self._claves:
+                        primero_por_clave.setdefault(clave, trabajo_id)
+                if not primero_por_clave:
+                    return None
+                claves = sorted(primero_por_clave)
+                clave = next((c for c in claves if self._ultima_clave is None or c > self._ultima_clave), claves[0])
+                self._ultima_clave = clave
+                trabajo_id = primero_por_clave[clave]
+                ahora = time.time()
+                cursor = self._conexion.execute(
+                    "UPDATE trabajos SET estado = 'en_curso', iniciado = ?, host = ?, pid = ?, latido = ?"
+                    " WHERE trabajo_id = ? AND estado = 'pendiente'", (ahora, self._host, self._pid, ahora, trabajo_id)
+                )
+                self._conexion.commit()
+                if cursor.rowcount:
+                    break
+            self._en_curso.add(trabajo_id)
+            cursor = self._conexion.execute("SELECT * FROM trabajos WHERE trabajo_id = ?", (trabajo_id,))
+            return self._como_dict(cursor, cursor.fetchone())
+
+    def _trabajar(self):
+        while True:
+            with self._condicion:
+                trabajo = None
+                while not self._detenido and trabajo is None:
+                    trabajo = self._tomar_siguiente()
+                    if trabajo is None:
+                        self._condicion.wait(timeout=5)
+                if self._detenido:
+                    if trabajo is not None:
+                        self._actualizar(trabajo["trabajo_id"], estado="pendiente", host=None, pid=None, latido=None)
+                        self._en_curso.discard(trabajo["trabajo_id"])
+                    return
+            self._ejecutar(trabajo)
+
+    def _actualizar(self, trabajo_id, **campos):
+        with self._lock:
+            self._conexion.execute(
+                f"UPDATE trabajos SET {', '.join(f'{campo} = ?' for campo in campos)} WHERE trabajo_id = ?",
+                (*campos.values(), trabajo_id)
+            )
+            self._conexion.commit()
+
+    def _ejecutar(self, trabajo):
+        trabajo_id, run_id, opciones = trabajo["trabajo_id"], trabajo["run_id"], trabajo["opciones"]
+        trazador = self._trazadores.setdefault(trabajo_id, Trazador(run_id))
+        progreso = {"analisis": 0, "recomendaciones": 0}
+        ultima_escritura = [0.0]
+
+        # Guarda el avance en la cola cada `intervalo_progreso` segundos
+        def al_progresar(evento):
+            if trabajo_id in self._cancelados:
+                raise TrabajoCancelado()
+            if evento["etapa"] == "inicio":
+                self._actualizar(trabajo_id, total=evento["total"], plan=json.dumps(evento["plan"]))
+                return
+            progreso[evento["etapa"]] = evento["completadas"]
+            ahora = time.monotonic()
+            if ahora - ultima_escritura[0] >= self.intervalo_progreso or evento["completadas"] == evento["total"]:
+                ultima_escritura[0] = ahora
+                self._actualizar(trabajo_id, **progreso)
+
+        try:
+            backend = self.crear_backend(self._claves[trabajo["clave"]])
+            pipeline.enriquecer_corrida(
+                backend, self.almacen, run_id, reprocesar_fallidas=opciones["reprocesar_fallidas"],
+                limitador=self.limitador.para_clave(trabajo["clave"]), cache=self.cache, leer_cache=opciones["leer_cache"],
+                max_concurrencia=opciones["max_concurrencia"], al_progresar=al_progresar, trazador=trazador,
+                tamano_lote=opciones["tamano_lote"]
+            )
+        except TrabajoCancelado:
+            self._actualizar(trabajo_id, estado="cancelado", terminado=time.time(), **progreso)
+        except Exception as e:
+            traceback.print_exc()
+            self._actualizar(trabajo_id, estado="fallido", terminado=time.time(), error=str(e), **progreso)
+        else:
+            self._actualizar(trabajo_id, estado="terminado", terminado=time.time(),
+                             fallidas=pipeline.contar_fallidas(self.almacen.resultados(run_id)), **progreso)
+        finally:
+            self._cancelados.discard(trabajo_id)
+            self._en_curso.discard(trabajo_id)
+            with self._lock:
+                self._olvidar_trazador(trabajo_id)